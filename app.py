@@ -1,11 +1,17 @@
-from flask import Flask, render_template, request, jsonify
-from image_processor import ImageProcessor
-from reddit_client import RedditClient
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from http_session import connection_stats
+import metrics
+import json
+import math
 import os
 import re
+import time
+import threading
 import logging
 import sys
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timezone
 
 # Configure logging
 logging.basicConfig(
@@ -19,8 +25,103 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-image_processor = ImageProcessor()
-reddit_client = RedditClient()
+
+# Clients are built lazily in each worker process, never at import time: with
+# gunicorn's preload_app the master imports this module and then forks, and
+# sessions, SQLite handles and thread pools must not be shared across a fork
+_services = {}
+_services_lock = threading.RLock()
+_services_pid = None
+_readiness = {}
+_warmup_thread = None
+
+
+def _reset_after_fork():
+    """Forget anything inherited from the parent process"""
+    global _services_pid, _warmup_thread
+    if _services_pid != os.getpid():
+        with _services_lock:
+            if _services_pid != os.getpid():
+                _services.clear()
+                _readiness.clear()
+                _readiness.update({'image_processing': False, 'reddit': False, 'error': None})
+                _warmup_thread = None
+                _services_pid = os.getpid()
+
+
+def _service(name, build):
+    _reset_after_fork()
+    service = _services.get(name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = build()
+    return service
+
+
+def get_image_processor():
+    """This worker's ImageProcessor; importing it pulls in numpy, PIL, scipy and imagehash"""
+    def build():
+        from image_processor import ImageProcessor
+        return ImageProcessor()
+    return _service('image_processor', build)
+
+
+def get_reddit_client():
+    """This worker's RedditClient, authenticated on first use rather than at import"""
+    def build():
+        from reddit_client import RedditClient
+        # Share one processor (and its pooled HTTP session) with the Reddit client
+        return RedditClient(processor=get_image_processor())
+    return _service('reddit_client', build)
+
+
+def get_scan_jobs():
+    def build():
+        from scan_jobs import ScanJobManager
+        return ScanJobManager(get_reddit_client())
+    return _service('scan_jobs', build)
+
+
+def preload():
+    """Import the heavy modules without building any clients; safe before fork"""
+    import image_processor  # noqa: F401
+    import reddit_client  # noqa: F401
+    import scan_jobs  # noqa: F401
+
+
+def _warm_up():
+    started = time.perf_counter()
+    try:
+        from PIL import Image
+        # One tiny hash initialises numpy/scipy/PIL internals the first request would pay for
+        get_image_processor().compute_image_hashes(Image.new('L', (64, 64)))
+        _readiness['image_processing'] = True
+        get_scan_jobs()
+        _readiness['reddit'] = True
+        _readiness['error'] = None
+        logger.info(f"Worker {os.getpid()} warmed up in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        _readiness['error'] = str(e)
+        logger.error(f"Worker {os.getpid()} warm-up failed: {str(e)}")
+
+
+def start_warmup():
+    """Build this worker's clients in the background; called after fork and on first request"""
+    global _warmup_thread
+    _reset_after_fork()
+    # A failed warm-up (e.g. Reddit unreachable) is retried by the next request
+    if _warmup_thread is None or (_readiness['error'] and not _warmup_thread.is_alive()):
+        with _services_lock:
+            if _warmup_thread is None or (_readiness['error'] and not _warmup_thread.is_alive()):
+                _warmup_thread = threading.Thread(target=_warm_up, name='warmup', daemon=True)
+                _warmup_thread.start()
+
+
+@app.before_request
+def ensure_warmup():
+    start_warmup()
 
 @app.route('/')
 def index():
@@ -30,85 +131,330 @@ def index():
 def main():
     return render_template('main.html')
 
+class ScanRequestError(Exception):
+    """A check-duplicates request that should be answered with an error response"""
+
+    def __init__(self, payload, status=400):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status = status
+
+
+def _failure_payload(source, e):
+    """Error body for a failure while hashing or scanning, worded per input type"""
+    if source == 'url':
+        return {
+            'error': str(e),
+            'details': 'Failed to process URL. Make sure it points to a valid Reddit post or image.'
+        }
+    return {
+        'error': 'Failed to process image',
+        'details': str(e)
+    }
+
+
+SUBREDDIT_REGEX = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_]{2,20}$')
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+# Also match mirrored, rotated and cropped reposts unless a request sets robust=0
+ROBUST_MATCHING = os.getenv('ROBUST_MATCHING', '0') == '1'
+
+# Limits for /api/batch-check
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 50))
+BATCH_HASH_WORKERS = int(os.getenv('BATCH_HASH_WORKERS', 8))
+# Largest accepted batch request body; uploads stay in Werkzeug's spooled files
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 100 * 1024 * 1024))
+# Whole-stream budget, under gunicorn's 120s worker timeout; hashing the
+# queries may use at most BATCH_HASH_DEADLINE of it, the scan gets the rest
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', 100))
+BATCH_HASH_DEADLINE = float(os.getenv('BATCH_HASH_DEADLINE', 30))
+
+
+def _parse_subreddits():
+    subreddits = request.form.getlist('subreddit[]')  # Get list of subreddits
+
+    if not subreddits:
+        raise ScanRequestError({'error': 'No subreddits provided'})
+
+    # Validate each subreddit name
+    for subreddit in subreddits:
+        if not SUBREDDIT_REGEX.match(subreddit):
+            raise ScanRequestError({'error': f'Invalid subreddit name: {subreddit}'})
+    return subreddits
+
+
+def _parse_timestamp(value, field):
+    """Unix seconds or an ISO 8601 date/time (UTC unless it carries an offset)"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        if not math.isfinite(seconds):
+            raise ScanRequestError({'error': f'Invalid {field}', 'details': 'Must be a finite number of seconds'})
+        return seconds
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ScanRequestError({
+            'error': f'Invalid {field}',
+            'details': 'Use Unix seconds or an ISO 8601 date such as 2024-05-01'
+        })
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _parse_time_window():
+    """
+    Optional since/until form fields. Either one turns the request into a
+    search of the crawled history posted in [since, until) instead of hot posts.
+    """
+    since = request.form.get('since', '').strip()
+    until = request.form.get('until', '').strip()
+    since = _parse_timestamp(since, 'since') if since else None
+    until = _parse_timestamp(until, 'until') if until else None
+    if since is not None and until is not None and since >= until:
+        raise ScanRequestError({'error': 'since must be earlier than until'})
+    return since, until
+
+
+def _parse_robust():
+    """The optional robust form field (1/0), defaulting to ROBUST_MATCHING"""
+    value = request.form.get('robust', '').strip().lower()
+    if not value:
+        return ROBUST_MATCHING
+    return value in ('1', 'true', 'yes', 'on')
+
+
+def _check_upload(uploaded_file):
+    if not uploaded_file.filename:
+        raise ScanRequestError({'error': 'No file selected'})
+
+    # Validate file extension
+    ext = os.path.splitext(uploaded_file.filename)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ScanRequestError({
+            'error': 'Invalid file type',
+            'details': f'Allowed file types are: {", ".join(ALLOWED_EXTENSIONS)}'
+        })
+
+
+def _hash_image_url(image_url, robust=False):
+    """Hash the image behind a Reddit post, Reddit media or plain image URL"""
+    # Add protocol if missing
+    if not image_url.startswith(('http://', 'https://')):
+        image_url = 'https://' + image_url
+
+    if 'reddit.com' in image_url and 'comments/' in image_url:
+        # It's a Reddit post URL
+        try:
+            return get_reddit_client().hash_from_reddit_url(image_url, robust=robust)
+        except Exception as e:
+            raise Exception(f"Failed to process Reddit post: {str(e)}")
+    elif 'preview.redd.it' in image_url or '/media?url=' in image_url or 'i.redd.it' in image_url:
+        # Handle preview URLs directly
+        clean_url = get_reddit_client().clean_reddit_url(image_url)
+        return get_image_processor().hash_from_url(clean_url, robust=robust)
+    # Regular image URL
+    return get_image_processor().hash_from_url(image_url, robust=robust)
+
+
+def _parse_scan_request():
+    """
+    Validate the check-duplicates form and hash the query image.
+
+    Returns (image_hashes, subreddits, source) where source is 'url' or 'file';
+    raises ScanRequestError with the response to send otherwise.
+    """
+    image_url = request.form.get('image_url')
+    uploaded_file = request.files.get('image')
+    subreddits = _parse_subreddits()
+    robust = _parse_robust()
+        
+    if not image_url and not uploaded_file:
+        raise ScanRequestError({'error': 'No image or URL provided'})
+
+    if image_url:
+        try:
+            image_hash = _hash_image_url(image_url, robust)
+        except Exception as e:
+            raise ScanRequestError(_failure_payload('url', e))
+        return image_hash, subreddits, 'url'
+
+    _check_upload(uploaded_file)
+    try:
+        image_hash = get_image_processor().hash_from_file(uploaded_file, robust)
+    except Exception as e:
+        raise ScanRequestError(_failure_payload('file', e))
+    return image_hash, subreddits, 'file'
+
+
 @app.route('/api/check-duplicates', methods=['POST'])
 def check_duplicates():
+    """Synchronous scan; kept for API clients, the web UI uses /api/jobs"""
     try:
-        image_url = request.form.get('image_url')
-        uploaded_file = request.files.get('image')
-        subreddits = request.form.getlist('subreddit[]')  # Get list of subreddits
-
-        if not subreddits:
-            return jsonify({'error': 'No subreddits provided'}), 400
-
-        # Validate each subreddit name
-        subreddit_regex = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_]{2,20}$')
-        for subreddit in subreddits:
-            if not subreddit_regex.match(subreddit):
-                return jsonify({'error': f'Invalid subreddit name: {subreddit}'}), 400
-            
-        if not image_url and not uploaded_file:
-            return jsonify({'error': 'No image or URL provided'}), 400
-            
-        # Add protocol if missing
-        if image_url and not image_url.startswith(('http://', 'https://')):
-            image_url = 'https://' + image_url
-
-        if image_url:
-            try:                # Handle Reddit URLs
-                if 'reddit.com' in image_url and 'comments/' in image_url:
-                    # It's a Reddit post URL
-                    results = reddit_client.find_duplicates_from_url(image_url, subreddits)
-                elif 'preview.redd.it' in image_url or '/media?url=' in image_url or 'i.redd.it' in image_url:
-                    # Handle preview URLs directly
-                    clean_url = reddit_client.clean_reddit_url(image_url)
-                    image_hash = image_processor.hash_from_url(clean_url)
-                    results = reddit_client.find_duplicates(image_hash, subreddits)
-                else:
-                    # Regular image URL
-                    image_hash = image_processor.hash_from_url(image_url)
-                    results = reddit_client.find_duplicates(image_hash, subreddits)
-                
-                return jsonify({
-                    'success': True,
-                    'results': results,
-                    'count': len(results)
-                })
+        with metrics.request_trace('POST /api/check-duplicates'):
+            since, until = _parse_time_window()
+            image_hash, subreddits, source = _parse_scan_request()
+            try:
+                results = get_reddit_client().find_duplicates(image_hash, subreddits, since=since, until=until)
             except Exception as e:
-                return jsonify({
-                    'error': str(e),
-                    'details': 'Failed to process URL. Make sure it points to a valid Reddit post or image.'
-                }), 400
-        else:
+                return jsonify(_failure_payload(source, e)), 400
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results)
+        })
+    except ScanRequestError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        return jsonify({
+            'error': 'An unexpected error occurred',
+            'details': str(e)
+        }), 500
+
+def _hash_batch_query(query, robust):
+    if query['source'] == 'url':
+        return _hash_image_url(query['input'], robust)
+    return get_image_processor().hash_from_file(query['file'], robust)
+
+
+def _batch_lines(queries, subreddits, since=None, until=None, robust=False):
+    """NDJSON lines for /api/batch-check: failed queries as soon as hashing fails, the rest after one scan"""
+    def line(query, payload):
+        return json.dumps({'index': query['index'], 'source': query['source'],
+                           'input': query['input'], **payload}) + '\n'
+
+    with metrics.request_trace(f'POST /api/batch-check ({len(queries)} images)'):
+        started = time.monotonic()
+        hash_timeout = min(BATCH_HASH_DEADLINE, BATCH_DEADLINE)
+        hashed = []
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_HASH_WORKERS, len(queries)))
+        futures = {executor.submit(metrics.bind(_hash_batch_query), query, robust): query for query in queries}
+        pending = set(futures)
+
+        def outcome(future):
+            pending.discard(future)
+            query = futures[future]
             try:
-                if not uploaded_file.filename:
-                    return jsonify({'error': 'No file selected'}), 400
-                    
-                # Validate file extension
-                allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-                ext = os.path.splitext(uploaded_file.filename)[1].lower()
-                if ext not in allowed_extensions:
-                    return jsonify({
-                        'error': 'Invalid file type',
-                        'details': f'Allowed file types are: {", ".join(allowed_extensions)}'
-                    }), 400
-                image_hash = image_processor.hash_from_file(uploaded_file)
-                results = reddit_client.find_duplicates(image_hash, subreddits)
-                return jsonify({
-                    'success': True,
-                    'results': results,
-                    'count': len(results)
-                })
+                hashed.append((query, future.result()))
             except Exception as e:
-                return jsonify({
-                    'error': 'Failed to process image',
-                    'details': str(e)
-                }), 400
+                return line(query, {'success': False, **_failure_payload(query['source'], e)})
+
+        try:
+            for future in as_completed(futures, timeout=hash_timeout):
+                failed = outcome(future)
+                if failed:
+                    yield failed
+        except FuturesTimeoutError:
+            # Report what is still hashing instead of waiting on slow hosts
+            error = Exception(f"Image hashing did not finish within {hash_timeout:.0f}s")
+            for future in sorted(pending, key=lambda future: futures[future]['index']):
+                if future.done():
+                    failed = outcome(future)
+                else:
+                    failed = line(futures[future], {'success': False, **_failure_payload(futures[future]['source'], error)})
+                if failed:
+                    yield failed
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if not hashed:
+            return
+
+        hashed.sort(key=lambda item: item[0]['index'])
+        try:
+            results = get_reddit_client().find_duplicates_batch(
+                [hashes for _, hashes in hashed], subreddits, since=since, until=until,
+                deadline=started + BATCH_DEADLINE
+            )
+        except Exception as e:
+            for query, _ in hashed:
+                yield line(query, {'success': False, **_failure_payload(query['source'], e)})
+            return
+        for (query, _), matches in zip(hashed, results):
+            yield line(query, {'success': True, 'results': matches, 'count': len(matches)})
+
+
+@app.route('/api/batch-check', methods=['POST'])
+def batch_check():
+    """
+    Check many images at once: image_urls[] and images[] uploads against subreddit[].
+    Each subreddit is scanned once for the whole batch; one NDJSON line per image is
+    streamed back, in request order except that images which fail to hash come first.
+    """
+    try:
+        # Checked before the form is parsed, so an oversized body is never spooled
+        if request.content_length is None:
+            raise ScanRequestError({'error': 'Length required'}, status=411)
+        if request.content_length > BATCH_MAX_BYTES:
+            raise ScanRequestError({
+                'error': 'Batch too large',
+                'details': f'A batch request may carry at most {BATCH_MAX_BYTES // (1024 * 1024)} MiB'
+            }, status=413)
+        subreddits = _parse_subreddits()
+        since, until = _parse_time_window()
+        robust = _parse_robust()
+        image_urls = [url.strip() for url in request.form.getlist('image_urls[]') if url.strip()]
+        uploaded_files = request.files.getlist('images[]')
+        if not image_urls and not uploaded_files:
+            raise ScanRequestError({'error': 'No images or URLs provided'})
+        if len(image_urls) + len(uploaded_files) > BATCH_MAX_IMAGES:
+            raise ScanRequestError({
+                'error': 'Too many images',
+                'details': f'At most {BATCH_MAX_IMAGES} images can be checked per batch'
+            }, status=413)
+
+        queries = [{'source': 'url', 'input': url, 'file': None} for url in image_urls]
+        for uploaded_file in uploaded_files:
+            _check_upload(uploaded_file)
+            # Hashed straight from Werkzeug's spooled file while the stream runs
+            queries.append({'source': 'file', 'input': uploaded_file.filename, 'file': uploaded_file.stream})
+        for index, query in enumerate(queries):
+            query['index'] = index
+
+        # The request context, and with it the uploaded files, lives until the stream ends
+        return Response(stream_with_context(_batch_lines(queries, subreddits, since, until, robust)),
+                        mimetype='application/x-ndjson')
+    except ScanRequestError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        return jsonify({
+            'error': 'An unexpected error occurred',
+            'details': str(e)
+        }), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def create_scan_job():
+    """Hash the query image, then enqueue the subreddit scan and return its job ID"""
+    try:
+        with metrics.request_trace('POST /api/jobs'):
+            since, until = _parse_time_window()
+            image_hash, subreddits, _ = _parse_scan_request()
+        job_id, coalesced = get_scan_jobs().submit(image_hash, subreddits, since, until)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'coalesced': coalesced,
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
+    except ScanRequestError as e:
+        return jsonify(e.payload), e.status
     except Exception as e:
         return jsonify({
             'error': 'An unexpected error occurred',
             'details': str(e)
         }), 500
 
+@app.route('/api/jobs/<job_id>')
+def get_scan_job(job_id):
+    """Poll a scan job; pass ?after=<next> to receive only matches found since the last poll"""
+    after = request.args.get('after', 0, type=int)
+    job = get_scan_jobs().get(job_id, after)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/api/report', methods=['POST'])
 def report_post():
     post_id = request.form.get('post_id')
@@ -121,6 +467,34 @@ def report_post():
         'report_id': f'report_{post_id or "unknown"}_{int(datetime.utcnow().timestamp())}'
     })
 
+@app.route('/api/stats/http')
+def http_stats():
+    """Per-host connection reuse and retry counters for this worker"""
+    return jsonify(connection_stats())
+
+@app.route('/api/stats/cache')
+def cache_stats():
+    """Listing/subreddit cache hit, miss and refresh counters for this worker"""
+    return jsonify(get_reddit_client().listing_cache.get_stats())
+
+@app.route('/api/ready')
+def readiness():
+    """200 once this worker's Reddit client and image stack are built and warm, 503 until then"""
+    _reset_after_fork()
+    status = dict(_readiness)
+    status['ready'] = bool(status['image_processing'] and status['reddit'])
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms and scan counters, summed over all workers sharing METRICS_DIR"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats/query-cache')
+def query_cache_stats():
+    """Query-image hash cache size, limits and hit/eviction counters for this worker"""
+    return jsonify(get_image_processor().query_cache.get_stats())
+
 if __name__ == '__main__':
     # Use environment variable for port with a default value
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,28 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Write to a temporary file beside path and rename it over path when the
+    block succeeds, so readers never see a partial file
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, mode) as handle:
+            yield handle
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json(path, data):
+    with atomic_write(path) as handle:
+        json.dump(data, handle)
@@ -0,0 +1,110 @@
+"""
+Offline comparison of checking a modqueue one image at a time against
+POST /api/batch-check.
+
+M query images (variants of the fixtures) are checked against the same
+subreddits two ways, each on a fresh app with empty caches:
+  single  one POST /api/check-duplicates per image
+  batch   one POST /api/batch-check carrying every image as an upload
+
+Reported per mode: wall time, process CPU, candidate image downloads and the
+number of matches, which must agree.
+
+    python benchmarks/bench_batch_check.py --queries 20 --subreddits 3
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_reddit import ImageServer, image_variants  # noqa: E402
+
+
+def run_mode(mode, args, server):
+    """Run one mode in a child process so each starts with cold caches and its own CPU clock"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', mode, '--image-base', server.base_url,
+             '--tmp', tmp, *[f'--{name}={value}' for name, value in (
+                 ('queries', args.queries), ('subreddits', args.subreddits), ('posts', args.posts),
+                 ('listing-latency', args.listing_latency))]],
+            check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def child(args):
+    from benchmarks.bench_check_duplicates import load_app
+
+    app = load_app(args.tmp, type('Server', (), {'base_url': args.image_base})(), args)
+    client = app.app.test_client()
+    subreddits = [f'modqueue{index}' for index in range(args.subreddits)]
+    # Variant 0 is the fixture the fake posts serve, so those queries match
+    queries = image_variants(args.queries, 640)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    matches = 0
+    if args.child == 'single':
+        for index, query in enumerate(queries):
+            response = client.post('/api/check-duplicates', content_type='multipart/form-data', data={
+                'subreddit[]': subreddits, 'image': (io.BytesIO(query), f'{index}.jpg')
+            })
+            matches += response.get_json()['count']
+    else:
+        response = client.post('/api/batch-check', content_type='multipart/form-data', data={
+            'subreddit[]': subreddits,
+            'images[]': [(io.BytesIO(query), f'{index}.jpg') for index, query in enumerate(queries)]
+        })
+        for line in response.get_data(as_text=True).splitlines():
+            matches += json.loads(line).get('count', 0)
+    print(json.dumps({
+        'wall_s': time.perf_counter() - start,
+        'cpu_s': time.process_time() - cpu_start,
+        'matches': matches,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--queries', type=int, default=20, help='query images in the modqueue')
+    parser.add_argument('--subreddits', type=int, default=3)
+    parser.add_argument('--posts', type=int, default=50, help='posts per subreddit listing')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per image response')
+    parser.add_argument('--listing-latency', type=float, default=0.1, help='seconds per listing call')
+    parser.add_argument('--child', choices=('single', 'batch'), help=argparse.SUPPRESS)
+    parser.add_argument('--image-base', help=argparse.SUPPRESS)
+    parser.add_argument('--tmp', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    results = {}
+    with ImageServer(latency=args.latency) as server:
+        for mode in ('single', 'batch'):
+            before = server.stats()
+            results[mode] = run_mode(mode, args, server)
+            results[mode]['images'] = server.stats()['images'] - before['images']
+
+    print(f"{args.queries} query images x {args.subreddits} subreddits x {args.posts} posts, "
+          f"image latency {args.latency * 1000:.0f}ms, listing latency {args.listing_latency * 1000:.0f}ms")
+    print(f"{'mode':<7} {'wall s':>7} {'cpu s':>6} {'downloads':>10} {'matches':>8}")
+    for mode, result in results.items():
+        print(f"{mode:<7} {result['wall_s']:>7.2f} {result['cpu_s']:>6.2f} "
+              f"{result['images']:>10} {result['matches']:>8}")
+    if results['single']['matches'] != results['batch']['matches']:
+        print("MISMATCH: batch and single-image checks found different matches", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Offline end-to-end benchmark of POST /api/check-duplicates.
+
+The real Flask app runs in-process against the fake Reddit provider and the
+local image server from benchmarks/fake_reddit.py, with fresh SQLite stores
+in a temporary directory, so no credentials or network access are needed.
+
+Two phases are measured:
+  cold  every request scans subreddits no earlier request touched, so every
+        listing is fetched and every image downloaded and hashed
+  warm  the cold requests are replayed; listings and hashes come from the caches
+
+Reported per phase: p50/p99 request latency, images per second, bytes
+downloaded and process CPU per image hashed. With --max-p99-ms or
+--max-cpu-ms-per-image the script exits 1 when the cold phase exceeds
+them, for use as a CI regression gate.
+
+    python benchmarks/bench_check_duplicates.py --requests 20 --latency 0.05 --error-rate 0.02
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_reddit import ImageServer  # noqa: E402
+
+QUERY_IMAGE = os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def load_app(tmp, server, args):
+    """Import app.py wired to the fakes; its module-level clients read these variables"""
+    os.environ.update({
+        'REDDIT_PROVIDER': 'benchmarks.fake_reddit:from_env',
+        'FAKE_REDDIT_IMAGE_BASE': server.base_url,
+        'FAKE_REDDIT_POSTS': str(args.posts),
+        'FAKE_REDDIT_LISTING_LATENCY': str(args.listing_latency),
+        'HASH_STORE_PATH': os.path.join(tmp, 'hashes.db'),
+        'LISTING_CACHE_PATH': os.path.join(tmp, 'listing_cache.db'),
+        'SCAN_JOBS_PATH': os.path.join(tmp, 'scan_jobs.db'),
+    })
+    os.environ.pop('QUERY_CACHE_PATH', None)
+    # app.py logs to app.log in the working directory
+    os.chdir(tmp)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app
+    return app
+
+
+def run_phase(client, server, batches, concurrency):
+    with open(QUERY_IMAGE, 'rb') as handle:
+        query = handle.read()
+
+    def request(subreddits):
+        data = {'subreddit[]': subreddits, 'image': (io.BytesIO(query), 'query.jpg')}
+        start = time.perf_counter()
+        response = client.post('/api/check-duplicates', data=data, content_type='multipart/form-data')
+        elapsed = time.perf_counter() - start
+        body = response.get_json()
+        if response.status_code != 200:
+            raise Exception(f"check-duplicates returned {response.status_code}: {body}")
+        return elapsed, body['count']
+
+    before = server.stats()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, batches))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    after = server.stats()
+
+    latencies = [elapsed for elapsed, _ in results]
+    images = after['images'] - before['images']
+    return {
+        'requests': len(results),
+        'matches': sum(count for _, count in results),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'wall_s': wall,
+        'images': images,
+        'image_errors': after['errors'] - before['errors'],
+        'images_per_s': images / wall if wall else 0.0,
+        'bytes': after['bytes'] - before['bytes'],
+        'cpu_s': cpu,
+        'cpu_ms_per_image': cpu * 1000 / images if images else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once')
+    parser.add_argument('--subreddits', type=int, default=2, help='subreddits per request')
+    parser.add_argument('--posts', type=int, default=50, help='posts per subreddit listing')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per image response')
+    parser.add_argument('--listing-latency', type=float, default=0.1, help='seconds per listing call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of image requests that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--width', type=int, default=1280, help='served image width in pixels')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--max-p99-ms', type=float, help='fail if cold p99 latency exceeds this')
+    parser.add_argument('--max-cpu-ms-per-image', type=float, help='fail if cold CPU per image exceeds this')
+    args = parser.parse_args()
+
+    batches = [
+        [f'bench{request}x{index}' for index in range(args.subreddits)]
+        for request in range(args.requests)
+    ]
+    with ImageServer(args.latency, args.error_rate, args.error_status, width=args.width) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        try:
+            app = load_app(tmp, server, args)
+            client = app.app.test_client()
+            results = {
+                'cold': run_phase(client, server, batches, args.concurrency),
+                'warm': run_phase(client, server, batches, args.concurrency),
+            }
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.requests} requests x {args.subreddits} subreddits x {args.posts} posts, "
+              f"concurrency {args.concurrency}, image latency {args.latency * 1000:.0f}ms, "
+              f"error rate {args.error_rate:.0%}")
+        print(f"{'phase':<6} {'p50 ms':>8} {'p99 ms':>8} {'images':>7} {'img/s':>7} "
+              f"{'MiB':>7} {'errors':>7} {'cpu ms/img':>11} {'matches':>8}")
+        for phase, result in results.items():
+            print(f"{phase:<6} {result['p50_ms']:>8.0f} {result['p99_ms']:>8.0f} {result['images']:>7} "
+                  f"{result['images_per_s']:>7.1f} {result['bytes'] / 2 ** 20:>7.1f} "
+                  f"{result['image_errors']:>7} {result['cpu_ms_per_image']:>11.1f} {result['matches']:>8}")
+
+    cold = results['cold']
+    failures = []
+    if args.max_p99_ms is not None and cold['p99_ms'] > args.max_p99_ms:
+        failures.append(f"cold p99 {cold['p99_ms']:.0f}ms exceeds {args.max_p99_ms:.0f}ms")
+    if args.max_cpu_ms_per_image is not None and cold['cpu_ms_per_image'] > args.max_cpu_ms_per_image:
+        failures.append(f"cold CPU {cold['cpu_ms_per_image']:.1f}ms/image exceeds "
+                        f"{args.max_cpu_ms_per_image:.1f}ms")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
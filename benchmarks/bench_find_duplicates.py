@@ -0,0 +1,117 @@
+"""
+Wall-clock benchmark of RedditClient.find_duplicates: sequential loop vs the
+concurrent fetch/hash pipeline.
+
+Reddit and the image hosts are replaced with in-process stand-ins whose
+downloads sleep for a fixed latency, so the numbers isolate scheduling.
+
+    python benchmarks/bench_find_duplicates.py --latency 0.2 --subreddits 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hash_store import HashStore  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from listing_cache import ListingCache  # noqa: E402
+from reddit_client import RedditClient  # noqa: E402
+
+QUERY_HASHES = {'phash': '0' * 64, 'dhash': '0' * 64, 'ahash': '0' * 64}
+OTHER_HASHES = {'phash': 'f' * 64, 'dhash': 'f' * 64, 'ahash': 'f' * 64}
+
+
+class SleepingProcessor(ImageProcessor):
+    """ImageProcessor whose downloads cost a fixed latency instead of network I/O"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def hash_from_url(self, url, use_cache=True):
+        time.sleep(self.latency)
+        return OTHER_HASHES
+
+
+class FakeReddit:
+    def __init__(self, posts_per_subreddit):
+        self.posts_per_subreddit = posts_per_subreddit
+
+    def subreddit(self, name):
+        posts = [
+            SimpleNamespace(
+                id=f'{name}{i}',
+                title=f'post {i}',
+                author='someone',
+                created_utc=1700000000 + i,
+                permalink=f'/r/{name}/comments/{name}{i}/',
+                url=f'https://i.redd.it/{name}{i}.jpg',
+                is_video=False,
+            )
+            for i in range(self.posts_per_subreddit)
+        ]
+        return SimpleNamespace(id=name, hot=lambda limit: posts[:limit])
+
+
+def make_client(latency, workers, per_host, posts, tmp):
+    client = RedditClient.__new__(RedditClient)
+    client.reddit = FakeReddit(posts)
+    client.processor = SleepingProcessor(latency)
+    client.hash_store = HashStore(os.path.join(tmp, 'bench.db'))
+    client.listing_cache = ListingCache(os.path.join(tmp, 'listings.db'))
+    client.scan_workers = workers
+    client.per_host_limit = per_host
+    client.scan_deadline = 600
+    client.subreddit_budget = 600
+    client.scan_source = 'live'
+    client.index_window = 30 * 86400
+    client.gallery_preview_width = 320
+    client.preview_width = 0
+    client._host_slots = {}
+    client._host_slots_lock = threading.Lock()
+    return client
+
+
+def run(label, latency, workers, per_host, posts, subreddits):
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(latency, workers, per_host, posts, tmp)
+        names = [f'bench{i}' for i in range(subreddits)]
+        start = time.perf_counter()
+        client.find_duplicates(QUERY_HASHES, names)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        client.find_duplicates(QUERY_HASHES, names)
+        warm = time.perf_counter() - start
+    print(f"{label:<32} cold {cold:7.2f}s   warm {warm:7.3f}s")
+    return cold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per image download')
+    parser.add_argument('--subreddits', type=int, default=3)
+    parser.add_argument('--posts', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=8)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    images = args.subreddits * args.posts
+    print(f"{images} images, {args.latency * 1000:.0f}ms simulated download latency")
+    sequential = run('sequential (1 worker)', args.latency, 1, 1, args.posts, args.subreddits)
+    concurrent = run(
+        f'pipeline ({args.workers} workers, {args.per_host}/host)',
+        args.latency, args.workers, args.per_host, args.posts, args.subreddits
+    )
+    print(f"speedup: {sequential / concurrent:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark HashIndex lookups against a linear compare_hashes-style scan.
+
+With --corpus images (the default) the corpus is hashed with
+ImageProcessor.compute_image_hashes from synthetic images: flat-colour shapes,
+as in memes and screenshots, and blurred noise standing in for photos. Each
+query image is planted three times as a recompressed or resized copy. With
+--corpus random the hashes are uniform random 256-bit values and the
+near-duplicates have up to `threshold` flipped bits.
+
+Every run checks that the index finds exactly what a linear scan over the
+banded types finds, and reports the share of the corpus an average lookup
+verifies and the largest bucket of each banded type. Pass
+--band-types phash dhash ahash to see dHash/aHash bands collapse on images.
+
+    python benchmarks/bench_hash_index.py --sizes 10000 100000
+    python benchmarks/bench_hash_index.py --corpus random --sizes 10000 100000 1000000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from hash_index import HashIndex, HASH_TYPES  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+
+BITS = 256
+IMAGE_SIZE = 96
+
+
+def random_hashes(rng):
+    return {hash_type: f'{rng.getrandbits(BITS):064x}' for hash_type in HASH_TYPES}
+
+
+def near_duplicate(hashes, rng, max_flips):
+    result = {}
+    for hash_type, value in hashes.items():
+        number = int(value, 16)
+        for bit in rng.sample(range(BITS), rng.randint(0, max_flips)):
+            number ^= 1 << bit
+        result[hash_type] = f'{number:064x}'
+    return result
+
+
+def synthetic_image(rng):
+    """Flat-colour shapes on a flat background, or blurred noise for a photo"""
+    if rng.random() < 0.5:
+        image = Image.effect_noise((IMAGE_SIZE, IMAGE_SIZE), rng.uniform(20, 80)).convert('RGB')
+        return image.filter(ImageFilter.GaussianBlur(rng.uniform(1, 6)))
+    image = Image.new('RGB', (IMAGE_SIZE, IMAGE_SIZE), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(1, 5)):
+        left, top = rng.randrange(IMAGE_SIZE), rng.randrange(IMAGE_SIZE)
+        box = (left, top, left + rng.randint(8, IMAGE_SIZE), top + rng.randint(8, IMAGE_SIZE))
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        (draw.rectangle if rng.random() < 0.5 else draw.ellipse)(box, fill=colour)
+    return image
+
+
+def repost(image, rng):
+    """A recompressed, slightly resized copy"""
+    scale = rng.uniform(0.8, 1.0)
+    image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=rng.randint(60, 90))
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def make_corpus(kind, size, queries, threshold, rng, processor):
+    """Return (corpus, query hashes); the first queries * 3 entries are near-duplicates"""
+    corpus = {}
+    if kind == 'random':
+        query_hashes = [random_hashes(rng) for _ in range(queries)]
+        for i in range(size):
+            if i < queries * 3:
+                corpus[i] = near_duplicate(query_hashes[i % queries], rng, threshold)
+            else:
+                corpus[i] = random_hashes(rng)
+        return corpus, query_hashes
+    query_images = [synthetic_image(rng) for _ in range(queries)]
+    query_hashes = [processor.compute_image_hashes(image) for image in query_images]
+    for i in range(size):
+        if i < queries * 3:
+            image = repost(query_images[i % queries], rng)
+        else:
+            image = synthetic_image(rng)
+        corpus[i] = processor.compute_image_hashes(image)
+    return corpus, query_hashes
+
+
+def linear_search(corpus, query, threshold, hash_types):
+    query_ints = {hash_type: int(value, 16) for hash_type, value in query.items()}
+    found = []
+    for key, hashes in corpus.items():
+        best = min((query_ints[t] ^ int(hashes[t], 16)).bit_count() for t in hash_types)
+        if best <= threshold:
+            found.append(key)
+    return found
+
+
+def verified(index, query):
+    """Entries a search verifies: everything sharing a band value with the query"""
+    keys = set()
+    for hash_type in index.band_types:
+        buckets = index._buckets[hash_type]
+        for band, band_value in enumerate(index._bands(int(query[hash_type], 16))):
+            keys.update(buckets[band].get(band_value, ()))
+    return len(keys)
+
+
+def bench(size, args, rng, processor):
+    queries, threshold, linear_queries = args.queries, args.threshold, args.linear_queries
+    start = time.perf_counter()
+    corpus, query_hashes = make_corpus(args.corpus, size, queries, threshold, rng, processor)
+    generate = time.perf_counter() - start
+
+    index = HashIndex(threshold=threshold, band_types=args.band_types)
+    start = time.perf_counter()
+    for key, hashes in corpus.items():
+        index.add(key, hashes)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [index.search(query) for query in query_hashes]
+    per_query = (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    expected = [linear_search(corpus, query, threshold, index.band_types)
+                for query in query_hashes[:linear_queries]]
+    linear = (time.perf_counter() - start) / linear_queries
+
+    recall_ok = all(
+        sorted(key for key, _ in results[i]) == sorted(expected[i])
+        for i in range(linear_queries)
+    )
+
+    touched = sum(verified(index, query) for query in query_hashes) / queries / size
+    largest = {
+        hash_type: max(len(bucket) for band in index._buckets[hash_type] for bucket in band.values()) / size
+        for hash_type in index.band_types
+    }
+    found = sum(len(result) for result in results)
+
+    start = time.perf_counter()
+    for key in range(0, min(size, 1000)):
+        index.remove(key)
+    delete = (time.perf_counter() - start) / min(size, 1000)
+
+    print(f"{size:>9,}  generate {generate:6.1f}s  build {build:6.2f}s  index {per_query * 1000:8.3f}ms/query  "
+          f"linear {linear * 1000:8.1f}ms/query  delete {delete * 1e6:6.1f}us  "
+          f"recall {'ok' if recall_ok else 'MISMATCH'}  found {found}")
+    print(f"{'':>9}  verified per lookup {touched:.2%} of corpus; largest bucket "
+          + ', '.join(f"{hash_type} {share:.1%}" for hash_type, share in largest.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', choices=('images', 'random'), default='images')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--linear-queries', type=int, default=3)
+    parser.add_argument('--threshold', type=int, default=15)
+    parser.add_argument('--band-types', nargs='+', choices=HASH_TYPES, default=['phash'])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    processor = ImageProcessor(hash_pool=False)
+    print(f"{args.corpus} corpus, threshold {args.threshold}, banded {', '.join(args.band_types)}")
+    for size in args.sizes:
+        bench(size, args, rng, processor)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Hashing throughput: request-thread hashing vs a thread pool vs the process pool.
+
+Large synthetic uploads are built from static/images and hashed from raw
+bytes, the same way ImageProcessor._hash_buffer does, so decode, resize and
+DCT costs are all included.
+
+    python benchmarks/bench_hash_pool.py --images 16 --megapixels 24 --format PNG
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+from hash_pool import ProcessHashPool  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from query_cache import QueryHashCache  # noqa: E402
+
+
+def make_uploads(count, megapixels, image_format):
+    source = Image.open(os.path.join(ROOT, 'static', 'images', 'duplicate2.jpg')).convert('RGB')
+    height = int((megapixels * 1_000_000 * source.height / source.width) ** 0.5)
+    width = int(height * source.width / source.height)
+    base = source.resize((width, height), Image.Resampling.BICUBIC)
+    uploads = []
+    for i in range(count):
+        # Vary the pixels slightly so no two uploads are byte-identical
+        variant = base.rotate(i * 0.5)
+        buffer = io.BytesIO()
+        if image_format == 'PNG':
+            variant.save(buffer, 'PNG', compress_level=1)
+        else:
+            variant.save(buffer, 'JPEG', quality=92)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed:8.2f}s {count / elapsed:8.2f} images/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--megapixels', type=int, default=24)
+    parser.add_argument('--format', choices=('PNG', 'JPEG'), default='PNG')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    uploads = make_uploads(args.images, args.megapixels, args.format)
+    total_mb = sum(len(data) for data in uploads) / 1e6
+    print(f"{args.images} x {args.megapixels}MP {args.format} uploads ({total_mb:.0f}MB), "
+          f"{os.cpu_count()} CPUs")
+
+    processor = ImageProcessor(hash_pool=False, query_cache=QueryHashCache())
+
+    def local(data):
+        return processor.compute_image_hashes(Image.open(io.BytesIO(data)))
+
+    baseline = timed('request thread (serial)', args.images, lambda: [local(d) for d in uploads])
+
+    for workers in args.workers:
+        with ThreadPoolExecutor(max_workers=workers) as threads:
+            timed(f'thread pool x{workers}', args.images, lambda: list(threads.map(local, uploads)))
+
+    for workers in args.workers:
+        pool = ProcessHashPool(workers=workers, timeout=300)
+        # Start the workers outside the timed region
+        list(ThreadPoolExecutor(workers).map(pool.hash_bytes, uploads[:workers]))
+        with ThreadPoolExecutor(max_workers=workers) as threads:
+            elapsed = timed(f'process pool x{workers}', args.images,
+                            lambda: list(threads.map(pool.hash_bytes, uploads)))
+        print(f"{'':<28}speedup vs serial {baseline / elapsed:5.2f}x")
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
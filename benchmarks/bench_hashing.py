@@ -0,0 +1,120 @@
+"""
+Per-image CPU time, peak RSS and hash agreement of the fused hashing path.
+
+Three modes are compared on the same files:
+  legacy  imagehash.phash/dhash/average_hash called separately (previous code)
+  exact   ImageProcessor with HASH_EXACT=1 (single grayscale conversion)
+  fast    ImageProcessor default (JPEG draft decode + shared reduced intermediate)
+
+Each mode/file pair runs in a fresh subprocess so peak RSS is not shared.
+Large synthetic JPEG/PNG uploads are generated from static/images.
+
+    python benchmarks/bench_hashing.py --megapixels 12 48
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = [
+    os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg'),
+    os.path.join(ROOT, 'static', 'images', 'duplicate2.jpg'),
+]
+
+
+def peak_rss_kb():
+    # VmHWM is reset on exec; ru_maxrss on Linux carries over the parent's peak
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def hash_once(mode, path):
+    """Runs inside the child process; prints a JSON result line"""
+    if mode == 'exact':
+        os.environ['HASH_EXACT'] = '1'
+    from PIL import Image
+    import imagehash
+    from image_processor import ImageProcessor
+
+    processor = ImageProcessor()
+    start = time.process_time()
+    image = Image.open(path)
+    if mode == 'legacy':
+        if image.mode == 'RGBA':
+            image = image.convert('RGB')
+        hashes = {
+            'phash': str(imagehash.phash(image, hash_size=processor.hash_size)),
+            'dhash': str(imagehash.dhash(image, hash_size=processor.hash_size)),
+            'ahash': str(imagehash.average_hash(image, hash_size=processor.hash_size)),
+        }
+    else:
+        hashes = processor.compute_image_hashes(image)
+    cpu = time.process_time() - start
+    print(json.dumps({'cpu': cpu, 'peak_mb': peak_rss_kb() / 1024, 'hashes': hashes}))
+
+
+def run_child(mode, path):
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--child', mode, path],
+        stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def make_large_fixtures(directory, megapixels_list):
+    from PIL import Image
+    source = Image.open(FIXTURES[1]).convert('RGB')
+    paths = []
+    for megapixels in megapixels_list:
+        height = int((megapixels * 1_000_000 * source.height / source.width) ** 0.5)
+        width = int(height * source.width / source.height)
+        large = source.resize((width, height), Image.Resampling.BICUBIC)
+        for ext in ('jpg', 'png'):
+            path = os.path.join(directory, f'upload_{megapixels}mp.{ext}')
+            large.save(path, quality=92) if ext == 'jpg' else large.save(path, compress_level=1)
+            paths.append(path)
+    return paths
+
+
+def distance(a, b):
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        hash_once(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=int, nargs='+', default=[12, 48])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = FIXTURES + make_large_fixtures(tmp, args.megapixels)
+        print(f"{'file':<22}{'mode':<8}{'cpu ms':>9}{'peak MB':>9}   bits vs legacy (p/d/a)")
+        for path in paths:
+            results = {mode: run_child(mode, path) for mode in ('legacy', 'exact', 'fast')}
+            legacy = results['legacy']['hashes']
+            for mode, result in results.items():
+                diff = '/'.join(
+                    str(distance(legacy[t], result['hashes'][t])) for t in ('phash', 'dhash', 'ahash')
+                )
+                print(f"{os.path.basename(path):<22}{mode:<8}{result['cpu'] * 1000:>9.1f}"
+                      f"{result['peak_mb']:>9.1f}   {diff}")
+
+
+if __name__ == '__main__':
+    main()
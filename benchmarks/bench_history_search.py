@@ -0,0 +1,174 @@
+"""
+Historical search over a year of stored hashes: the hash store alone versus
+the crawler's memory-mapped segments.
+
+A synthetic subreddit history of --rows images, spread evenly over --days
+days, is written to a fresh hash store. A few near-copies of the query images
+are planted at known times. The history is sealed in --seals rounds, as
+successive crawler cycles would, so each partition holds several segment
+files until it is compacted. Reported per time window:
+  sqlite     entries_for_subreddit + HashArray + batch_matches (the store alone)
+  segments   SegmentStore.search before compaction
+  compacted  SegmentStore.search after compaction
+with the wall time, peak Python heap (tracemalloc, numpy buffers included)
+and matches found. Disk usage before and after compaction and retention is
+reported at the end.
+
+    python benchmarks/bench_history_search.py --rows 200000 --days 365
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hash_array import HashArray  # noqa: E402
+from hash_store import HashStore  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from segment_store import SegmentStore  # noqa: E402
+
+SUBREDDIT = 'history'
+DAY = 86400
+
+
+def random_hashes(rng):
+    return {name: f'{rng.getrandbits(256):064x}' for name in ('phash', 'dhash', 'ahash')}
+
+
+def near_copy(hashes, rng, bits=3):
+    """The same hashes with a few bits flipped, as a recompressed repost would have"""
+    copy = {}
+    for name, value in hashes.items():
+        number = int(value, 16)
+        for bit in rng.sample(range(256), bits):
+            number ^= 1 << bit
+        copy[name] = f'{number:064x}'
+    return copy
+
+
+def populate(store, args, now, queries, rng):
+    """Write the synthetic history in one transaction; returns the planted (query, created_utc) pairs"""
+    planted = []
+    rows = []
+    start = now - args.days * DAY
+    total = args.planted * len(queries)
+    step = args.rows // total
+    for index in range(args.rows):
+        created_utc = start + (index + 0.5) * args.days * DAY / args.rows
+        # Spread evenly back from the newest post
+        age = args.rows - 1 - index
+        if age % step == 0 and age // step < total:
+            query_index = len(planted) % len(queries)
+            hashes = near_copy(queries[query_index], rng)
+            planted.append((query_index, created_utc))
+        else:
+            hashes = random_hashes(rng)
+        # Sealed in rounds: row i becomes sealable in round i % seals
+        hashed_at = now - (args.seals - index % args.seals) * 1000
+        rows.append((f'p{index}', f'https://i.redd.it/{index}.jpg', SUBREDDIT, hashes['phash'],
+                     hashes['dhash'], hashes['ahash'], created_utc, f'/r/{SUBREDDIT}/comments/p{index}/',
+                     hashed_at, f'Post {index}', 'someone', 0))
+    conn = store._connection()
+    with conn:
+        conn.executemany(
+            'INSERT INTO image_hashes (submission_id, image_url, subreddit, phash, dhash, ahash, '
+            'created_utc, permalink, hashed_at, title, author, position) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+    return planted
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    found = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='stored images in the history')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--queries', type=int, default=3)
+    parser.add_argument('--planted', type=int, default=4, help='near-copies planted per query')
+    parser.add_argument('--seals', type=int, default=6, help='crawler cycles the history is sealed in')
+    parser.add_argument('--retention-days', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    processor = ImageProcessor(hash_pool=False)
+    now = time.time()
+    queries = [random_hashes(rng) for _ in range(args.queries)]
+    query_array = HashArray.from_hashes(queries)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HashStore(os.path.join(tmp, 'hashes.db'))
+        planted = populate(store, args, now, queries, rng)
+        segments = SegmentStore(store, os.path.join(tmp, 'segments'))
+        for round_index in range(args.seals):
+            segments.seal_lag = (args.seals - round_index - 1) * 1000 + 1
+            segments.seal(SUBREDDIT)
+        files_before = sum(len(paths) for paths in segments.segments(SUBREDDIT).values())
+        bytes_before = segments.disk_usage(SUBREDDIT)
+
+        def sqlite_search(since):
+            rows = store.entries_for_subreddit(SUBREDDIT, since=since)
+            if not rows:
+                return 0
+            return int(processor.batch_matches(query_array, HashArray.from_hashes(rows)).sum())
+
+        def segment_search(since):
+            hits, _ = segments.search(processor, query_array, SUBREDDIT, since=since)
+            return len(hits)
+
+        windows = [('7 days', 7), ('30 days', 30), (f'{args.days} days', args.days)]
+        results = {}
+        for label, days in windows:
+            since = now - days * DAY
+            results[label] = {
+                'expected': sum(1 for _, created_utc in planted if created_utc >= since),
+                'sqlite': measure(lambda: sqlite_search(since)),
+                'segments': measure(lambda: segment_search(since)),
+            }
+        segments.compact(SUBREDDIT, force=True)
+        files_compacted = sum(len(paths) for paths in segments.segments(SUBREDDIT).values())
+        bytes_compacted = segments.disk_usage(SUBREDDIT)
+        for label, days in windows:
+            since = now - days * DAY
+            results[label]['compacted'] = measure(lambda: segment_search(since))
+
+        segments.retention_seconds = args.retention_days * DAY
+        segments.apply_retention(SUBREDDIT, now=now)
+        files_retained = sum(len(paths) for paths in segments.segments(SUBREDDIT).values())
+        bytes_retained = segments.disk_usage(SUBREDDIT)
+        rows_retained = store.count()
+
+    print(f"{args.rows} stored images over {args.days} days, {args.queries} queries, "
+          f"{len(planted)} planted near-copies, sealed in {args.seals} rounds")
+    print(f"{'window':<10} {'mode':<10} {'ms':>8} {'peak MiB':>9} {'found':>6} {'expected':>9}")
+    for label, result in results.items():
+        for mode in ('sqlite', 'segments', 'compacted'):
+            elapsed, peak, found = result[mode]
+            print(f"{label:<10} {mode:<10} {elapsed * 1000:>8.1f} {peak / 2 ** 20:>9.1f} "
+                  f"{found:>6} {result['expected']:>9}")
+    print(f"\nsegments: {files_before} files, {bytes_before / 2 ** 20:.1f} MiB; "
+          f"compacted {files_compacted} files, {bytes_compacted / 2 ** 20:.1f} MiB; "
+          f"after {args.retention_days}-day retention {files_retained} files, "
+          f"{bytes_retained / 2 ** 20:.1f} MiB, {rows_retained} hash store rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Accuracy and bandwidth of hashing Reddit preview thumbnails instead of the
+full-resolution source, used to pick PREVIEW_HASH_WIDTH.
+
+Every fixture (static/images plus synthetic variants) is encoded as a full
+source, then re-encoded at each Reddit preview width the way preview.redd.it
+serves them. For each width the report gives:
+  drift   bits the thumbnail's hashes differ from the source's (max over hash types)
+  recall  near-duplicate queries that still match the thumbnail, vs the source
+          (a rescaled/brightened repost and a 1% trim of every fixture)
+  fp      thumbnails matching a different fixture's query
+  bytes   thumbnail size and share of the source size
+  cpu     time to decode and hash one thumbnail
+
+    python benchmarks/bench_preview_hashing.py --tolerance 4
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageEnhance, ImageOps  # noqa: E402
+
+from image_processor import ImageProcessor  # noqa: E402
+
+FIXTURES = [
+    os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg'),
+    os.path.join(ROOT, 'static', 'images', 'duplicate2.jpg'),
+]
+
+# Widths listed in preview['images'][0]['resolutions'] and media_metadata 'p'
+PREVIEW_WIDTHS = (108, 216, 320, 640, 960, 1080)
+
+
+def scaled(image, width):
+    return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+
+def synthetic_sources(path):
+    """The fixture itself plus variants shaped like typical large uploads"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    image = Image.open(path).convert('RGB')
+    yield f'{name}', image, 'JPEG'
+    yield f'{name}-12mp', scaled(image, 4000), 'JPEG'
+    # Phone-style portrait crop
+    side = min(image.width, image.height)
+    crop = image.crop(((image.width - side * 9 // 16) // 2, 0,
+                       (image.width + side * 9 // 16) // 2, side))
+    yield f'{name}-portrait', crop.resize((1080, 1920), Image.LANCZOS), 'JPEG'
+    # Flat-colour graphic saved losslessly, the hardest case for aHash/dHash
+    graphic = ImageOps.posterize(image, 3).resize((image.width * 2, image.height * 2), Image.NEAREST)
+    yield f'{name}-graphic', graphic, 'PNG'
+
+
+def encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffer, 'JPEG', quality=quality)
+    else:
+        image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def near_duplicates(image):
+    """Typical reposts: rescaled, brightened and recompressed; and lightly trimmed"""
+    repost = ImageEnhance.Brightness(scaled(image, max(image.width * 6 // 10, 64))).enhance(1.08)
+    trimmed = image.crop((image.width // 100, image.height // 100,
+                          image.width - image.width // 100, image.height - image.height // 100))
+    return [Image.open(io.BytesIO(encode(variant, 'JPEG', 60))) for variant in (repost, trimmed)]
+
+
+def timed_hashes(processor, data):
+    start = time.process_time()
+    with Image.open(io.BytesIO(data)) as image:
+        hashes = processor.compute_image_hashes(image)
+    return hashes, (time.process_time() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tolerance', type=int, default=4,
+                        help='largest acceptable drift in bits from the source hashes')
+    parser.add_argument('--quality', type=int, default=80, help='JPEG quality of the thumbnails')
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    processor = ImageProcessor(hash_pool=False)
+    fixtures = []
+    for path in FIXTURES:
+        for name, image, fmt in synthetic_sources(path):
+            data = encode(image, fmt, 92)
+            source_hashes, source_ms = timed_hashes(processor, data)
+            queries = [processor.compute_image_hashes(query) for query in near_duplicates(image)]
+            fixtures.append({
+                'name': name, 'image': image, 'bytes': len(data), 'ms': source_ms,
+                'hashes': source_hashes, 'queries': queries,
+                'matches': sum(processor.compare_hashes(query, source_hashes) for query in queries)
+            })
+
+    print(f"{len(fixtures)} sources, threshold {processor.threshold}, tolerance {args.tolerance} bits")
+    for fixture in fixtures:
+        print(f"  {fixture['name']:<24} {fixture['image'].width}x{fixture['image'].height}  "
+              f"{fixture['bytes'] / 1024:8.1f} KiB  {fixture['ms']:6.1f} ms")
+    source_recall = sum(fixture['matches'] for fixture in fixtures)
+    print(f"\n{'width':>6} {'drift max':>9} {'mean':>5} {'recall':>7} {'fp':>3} "
+          f"{'KiB':>7} {'of source':>9} {'cpu ms':>7}")
+
+    recommended = None
+    for width in PREVIEW_WIDTHS:
+        drifts, recall, false_positives, sizes, shares, cpu = [], 0, 0, [], [], []
+        for fixture in fixtures:
+            # Reddit serves the source itself when it is narrower than the rendition
+            if fixture['image'].width > width:
+                data = encode(scaled(fixture['image'], width), 'JPEG', args.quality)
+                hashes, ms = timed_hashes(processor, data)
+            else:
+                data, hashes, ms = None, fixture['hashes'], fixture['ms']
+            drifts.append(max(
+                processor._hamming_distance(hashes[name], fixture['hashes'][name]) for name in hashes
+            ))
+            recall += sum(processor.compare_hashes(query, hashes) for query in fixture['queries'])
+            false_positives += sum(
+                processor.compare_hashes(query, hashes)
+                for other in fixtures if other['name'].split('-')[0] != fixture['name'].split('-')[0]
+                for query in other['queries']
+            )
+            size = len(data) if data else fixture['bytes']
+            sizes.append(size)
+            shares.append(size / fixture['bytes'])
+            cpu.append(ms)
+        print(f"{width:>6} {max(drifts):>9} {sum(drifts) / len(drifts):>5.1f} "
+              f"{recall:>3}/{source_recall:<3} {false_positives:>3} "
+              f"{sum(sizes) / len(sizes) / 1024:>7.1f} {sum(shares) / len(shares):>9.1%} "
+              f"{sum(cpu) / len(cpu):>7.1f}")
+        if (recommended is None and max(drifts) <= args.tolerance
+                and recall >= source_recall and false_positives == 0):
+            recommended = width
+
+    if recommended:
+        print(f"\nsmallest width within tolerance: PREVIEW_HASH_WIDTH={recommended}")
+    else:
+        print("\nno preview width stays within tolerance; keep PREVIEW_HASH_WIDTH=0")
+
+
+if __name__ == '__main__':
+    main()
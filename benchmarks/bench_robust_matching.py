@@ -0,0 +1,162 @@
+"""
+Recall and cost of robust matching (query-side transform hashes).
+
+Synthetic fixtures are built from static/images: each image whole plus its
+four overlapping quadrant crops, ten distinct sources in all. Every source is
+reposted the ways moderators see it (recompressed, mirrored, flipped, rotated,
+center-cropped, off-center-cropped) and the reposts are hashed as stored
+candidates. Each source is then used as the query, hashed plainly and with
+ImageProcessor.compute_robust_hashes. The report gives:
+  recall  reposts of the query's own source that match, per repost type
+  fp      reposts of the other sources that match
+  cost    query hashing time and the compare time against --candidates
+          stored hashes, plain vs robust
+
+    python benchmarks/bench_robust_matching.py --candidates 100000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageEnhance  # noqa: E402
+
+from hash_array import HashArray, flatten_queries  # noqa: E402
+from image_processor import ROBUST_TRANSFORMS, ImageProcessor  # noqa: E402
+
+FIXTURES = [
+    os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg'),
+    os.path.join(ROOT, 'static', 'images', 'duplicate2.jpg'),
+]
+
+
+def encode(image, quality=85):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def sources():
+    """Each fixture whole and as four quadrant crops covering 60% of each side"""
+    for path in FIXTURES:
+        name = os.path.splitext(os.path.basename(path))[0]
+        image = Image.open(path).convert('RGB')
+        yield name, image
+        width, height = image.size
+        for column in (0, 1):
+            for row in (0, 1):
+                left, top = column * width * 2 // 5, row * height * 2 // 5
+                yield f'{name}-q{column}{row}', image.crop((left, top, left + width * 3 // 5, top + height * 3 // 5))
+
+
+def center_crop(image, keep, shift=0.0):
+    width, height = image.size
+    crop_width, crop_height = round(width * keep), round(height * keep)
+    left = round((width - crop_width) / 2 + shift * width)
+    top = round((height - crop_height) / 2)
+    return image.crop((left, top, left + crop_width, top + crop_height))
+
+
+def reposts(image):
+    """How a source typically comes back: (kind, image)"""
+    recompressed = ImageEnhance.Brightness(image.resize(
+        (image.width * 4 // 5, image.height * 4 // 5), Image.LANCZOS)).enhance(1.05)
+    return [
+        ('recompress', recompressed),
+        ('mirror', image.transpose(Image.FLIP_LEFT_RIGHT)),
+        ('flip', image.transpose(Image.FLIP_TOP_BOTTOM)),
+        ('rotate90', image.transpose(Image.ROTATE_90)),
+        ('rotate180', image.transpose(Image.ROTATE_180)),
+        ('rotate270', image.transpose(Image.ROTATE_270)),
+        ('crop95', center_crop(image, 0.95)),
+        ('crop90', center_crop(image, 0.90)),
+        ('crop85', center_crop(image, 0.85)),
+        ('crop80', center_crop(image, 0.80)),
+        ('crop90-offset', center_crop(image, 0.90, shift=0.04)),
+        ('mirror+crop90', center_crop(image.transpose(Image.FLIP_LEFT_RIGHT), 0.90)),
+    ]
+
+
+def cpu_ms(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--candidates', type=int, default=100000, help='stored hashes for the compare timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    processor = ImageProcessor(hash_pool=False)
+    fixtures = []
+    for name, image in sources():
+        data = encode(image, 92)
+        candidates = [
+            (kind, processor.compute_image_hashes(Image.open(io.BytesIO(encode(repost)))))
+            for kind, repost in reposts(image)
+        ]
+        fixtures.append({'name': name, 'data': data, 'candidates': candidates})
+    kinds = [kind for kind, _ in fixtures[0]['candidates']]
+
+    plain_ms, robust_ms = [], []
+    recall = {mode: {kind: 0 for kind in kinds} for mode in ('plain', 'robust')}
+    false_positives = {'plain': 0, 'robust': 0}
+    for fixture in fixtures:
+        ms, plain = cpu_ms(lambda: processor.compute_image_hashes(Image.open(io.BytesIO(fixture['data']))),
+                           args.repeat)
+        plain_ms.append(ms)
+        ms, robust = cpu_ms(lambda: processor.compute_robust_hashes(Image.open(io.BytesIO(fixture['data']))),
+                            args.repeat)
+        robust_ms.append(ms)
+        for mode, query in (('plain', plain), ('robust', robust)):
+            query_array, owners = flatten_queries([query])
+            for other in fixtures:
+                found = processor.batch_matches(query_array, [hashes for _, hashes in other['candidates']], owners)[0]
+                for (kind, _), is_match in zip(other['candidates'], found):
+                    if other is fixture:
+                        recall[mode][kind] += bool(is_match)
+                    elif is_match and other['name'].split('-')[0] != fixture['name'].split('-')[0]:
+                        # Quadrants of the same photo overlap, so only cross-photo matches count
+                        false_positives[mode] += 1
+
+    rng = random.Random(args.seed)
+    stored = HashArray.from_hashes(
+        {name: f'{rng.getrandbits(256):064x}' for name in ('phash', 'dhash', 'ahash')}
+        for _ in range(args.candidates)
+    )
+    plain_query = flatten_queries([plain])
+    robust_query = flatten_queries([robust])
+    compare_plain, _ = cpu_ms(lambda: processor.batch_matches(plain_query[0], stored, plain_query[1]), args.repeat)
+    compare_robust, _ = cpu_ms(lambda: processor.batch_matches(robust_query[0], stored, robust_query[1]), args.repeat)
+
+    count = len(fixtures)
+    print(f"{count} sources from static/images, {len(kinds)} repost types each, threshold {processor.threshold}, "
+          f"{len(ROBUST_TRANSFORMS)} query transforms ({', '.join(ROBUST_TRANSFORMS)})")
+    print(f"\n{'repost':<15} {'plain':>7} {'robust':>7}")
+    for kind in kinds:
+        print(f"{kind:<15} {recall['plain'][kind]:>3}/{count:<3} {recall['robust'][kind]:>3}/{count:<3}")
+    total = count * len(kinds)
+    print(f"{'all':<15} {sum(recall['plain'].values()):>3}/{total:<3} {sum(recall['robust'].values()):>3}/{total:<3}")
+    print(f"{'false pos.':<15} {false_positives['plain']:>7} {false_positives['robust']:>7}")
+
+    plain_hash, robust_hash = sum(plain_ms) / count, sum(robust_ms) / count
+    print(f"\nper query        plain   robust   extra")
+    print(f"hash (ms)      {plain_hash:>7.1f} {robust_hash:>8.1f} {robust_hash - plain_hash:>+7.1f}")
+    print(f"compare vs {args.candidates // 1000}k "
+          f"{compare_plain:>5.1f} {compare_robust:>8.1f} {compare_robust - compare_plain:>+7.1f}")
+
+
+if __name__ == '__main__':
+    main()
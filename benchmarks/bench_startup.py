@@ -0,0 +1,123 @@
+"""
+Cold-start time of the gunicorn deployment, offline.
+
+gunicorn is launched with gunicorn.conf.py against the fake Reddit provider
+and local image server from benchmarks/fake_reddit.py. Measured from launch:
+  first   first served request (GET /)
+  scan    first completed POST /api/check-duplicates (1 subreddit, --posts posts)
+  ready   GET /api/ready answering 200, where the endpoint exists
+
+FAKE_REDDIT_AUTH_LATENCY stands in for the user.me() round trip to Reddit.
+
+    python benchmarks/bench_startup.py --runs 3 --auth-latency 0.5
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_reddit import ImageServer  # noqa: E402
+
+QUERY_IMAGE = os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(fn, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if fn():
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def run_once(server, args, tmp):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        REDDIT_PROVIDER='benchmarks.fake_reddit:from_env',
+        FAKE_REDDIT_IMAGE_BASE=server.base_url,
+        FAKE_REDDIT_POSTS=str(args.posts),
+        FAKE_REDDIT_AUTH_LATENCY=str(args.auth_latency),
+        HASH_STORE_PATH=os.path.join(tmp, 'hashes.db'),
+        LISTING_CACHE_PATH=os.path.join(tmp, 'listing_cache.db'),
+        SCAN_JOBS_PATH=os.path.join(tmp, 'scan_jobs.db'),
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+        '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), '--log-level', 'warning',
+        'app:app'
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=tmp, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        if not wait_for(lambda: requests.get(f'{base}/', timeout=5).ok, args.timeout):
+            raise Exception("gunicorn never served GET /")
+        result['first'] = time.perf_counter() - start
+
+        with open(QUERY_IMAGE, 'rb') as handle:
+            query = handle.read()
+        response = requests.post(
+            f'{base}/api/check-duplicates',
+            data={'subreddit[]': [f'startup{port}']},
+            files={'image': ('query.jpg', query)},
+            timeout=args.timeout
+        )
+        if not response.ok:
+            raise Exception(f"check-duplicates returned {response.status_code}: {response.text[:200]}")
+        result['scan'] = time.perf_counter() - start
+
+        if requests.get(f'{base}/api/ready', timeout=5).status_code != 404:
+            wait_for(lambda: requests.get(f'{base}/api/ready', timeout=5).ok, args.timeout)
+            result['ready'] = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--posts', type=int, default=5)
+    parser.add_argument('--auth-latency', type=float, default=0.5, help='simulated user.me() seconds')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    runs = []
+    with ImageServer(latency=0.02) as server:
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                runs.append(run_once(server, args, tmp))
+
+    print(f"{args.workers} workers, {args.auth_latency * 1000:.0f}ms simulated auth, {args.runs} runs")
+    for key, label in (('first', 'first request'), ('scan', 'first scan'), ('ready', 'ready')):
+        values = sorted(run[key] for run in runs if key in run)
+        if values:
+            print(f"{label:<14} median {values[len(values) // 2]:6.2f}s   "
+                  f"min {values[0]:6.2f}s   max {values[-1]:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
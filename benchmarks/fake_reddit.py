@@ -0,0 +1,243 @@
+"""
+Offline stand-ins for Reddit and its image hosts, used by the benchmarks.
+
+FakeReddit covers the parts of PRAW the app touches: subreddit(name) with
+.id, .hot() and .new(), and submission(id=). Every subreddit exists and
+lists FAKE_REDDIT_POSTS posts whose image URLs point at the local image
+server. Point the app at it with
+
+    REDDIT_PROVIDER=benchmarks.fake_reddit:from_env
+
+The image server runs in its own process so its CPU time does not count
+against the app. It serves JPEG variants of static/images with a set
+latency and error rate, and reports request/byte counters on /__stats:
+
+    python benchmarks/fake_reddit.py --port 8765 --latency 0.05 --error-rate 0.02
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIXTURES = [
+    os.path.join(ROOT, 'static', 'images', 'duplicate1.jpg'),
+    os.path.join(ROOT, 'static', 'images', 'duplicate2.jpg'),
+]
+
+# Share of listed posts that carry an image; the rest are text/link posts
+IMAGE_POST_RATIO = 0.8
+
+
+class FakeSubmission(SimpleNamespace):
+    """Just enough of praw.models.Submission for RedditClient.post_record"""
+
+    @property
+    def fullname(self):
+        return f't3_{self.id}'
+
+
+class FakeSubreddit:
+    def __init__(self, reddit, name):
+        self._reddit = reddit
+        self.display_name = name
+        self.id = zlib.crc32(name.lower().encode()) & 0xffffff
+
+    def _listing(self, limit):
+        time.sleep(self._reddit.listing_latency)
+        count = min(limit or self._reddit.posts, self._reddit.posts)
+        return [self._reddit.make_submission(self.display_name, index) for index in range(count)]
+
+    def hot(self, limit=100):
+        return self._listing(limit)
+
+    def new(self, limit=100):
+        return self._listing(limit)
+
+
+class FakeReddit:
+    """PRAW stand-in whose posts link to images on image_base (the local image server)"""
+
+    def __init__(self, image_base, posts=50, listing_latency=0.0, auth_latency=0.0):
+        self.image_base = image_base.rstrip('/')
+        self.posts = posts
+        self.listing_latency = listing_latency
+        self.auth_latency = auth_latency
+        self.user = SimpleNamespace(me=self._me)
+
+    def _me(self):
+        # Stands in for the authentication round trip to Reddit
+        time.sleep(self.auth_latency)
+        return 'offline'
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def make_submission(self, subreddit_name, index):
+        post_id = f'{subreddit_name.lower()}_{index}'
+        # Deterministic mix of image and text posts
+        has_image = (zlib.crc32(post_id.encode()) % 100) < IMAGE_POST_RATIO * 100
+        return FakeSubmission(
+            id=post_id,
+            title=f'Post {index} in r/{subreddit_name}',
+            author=f'user{index % 7}',
+            created_utc=1700000000 + index * 60,
+            permalink=f'/r/{subreddit_name}/comments/{post_id}/post_{index}/',
+            url=(f'{self.image_base}/{subreddit_name.lower()}/{index}.jpg' if has_image
+                 else f'https://www.reddit.com/r/{subreddit_name}/comments/{post_id}/'),
+            is_video=False
+        )
+
+    def submission(self, id):
+        subreddit_name, _, index = id.rpartition('_')
+        return self.make_submission(subreddit_name, int(index))
+
+
+def from_env():
+    """REDDIT_PROVIDER factory configured through FAKE_REDDIT_* variables"""
+    return FakeReddit(
+        os.getenv('FAKE_REDDIT_IMAGE_BASE', 'http://127.0.0.1:8765'),
+        posts=int(os.getenv('FAKE_REDDIT_POSTS', 50)),
+        listing_latency=float(os.getenv('FAKE_REDDIT_LISTING_LATENCY', 0)),
+        auth_latency=float(os.getenv('FAKE_REDDIT_AUTH_LATENCY', 0))
+    )
+
+
+def image_variants(count, width):
+    """
+    Distinct JPEGs derived from the fixtures. Variant 0 is duplicate1.jpg itself,
+    so posts that land on it match a duplicate1.jpg query.
+    """
+    from PIL import Image, ImageOps
+
+    sources = [Image.open(path).convert('RGB') for path in FIXTURES]
+    transforms = [None, Image.FLIP_LEFT_RIGHT, Image.ROTATE_180, Image.FLIP_TOP_BOTTOM]
+    variants = []
+    for index in range(count):
+        image = sources[index % len(sources)]
+        if index:
+            transform = transforms[(index // len(sources)) % len(transforms)]
+            if transform is not None:
+                image = image.transpose(transform)
+            # Seeded noise blend keeps variants from hashing alike
+            rng = random.Random(index)
+            noise = Image.effect_noise(image.size, 64 + rng.randint(0, 64)).convert('RGB')
+            image = Image.blend(ImageOps.autocontrast(image), noise, 0.35)
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        variants.append(buffer.getvalue())
+    return variants
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/__stats':
+            with server.lock:
+                body = json.dumps(server.stats).encode()
+            self._send(200, body, 'application/json')
+            return
+
+        time.sleep(server.latency)
+        with server.lock:
+            server.stats['requests'] += 1
+            failed = server.rng.random() < server.error_rate
+        if failed:
+            with server.lock:
+                server.stats['errors'] += 1
+            self._send(server.error_status, b'simulated failure', 'text/plain')
+            return
+
+        body = server.variants[zlib.crc32(self.path.encode()) % len(server.variants)]
+        with server.lock:
+            server.stats['images'] += 1
+            server.stats['bytes'] += len(body)
+        self._send(200, body, 'image/jpeg')
+
+
+def serve(port, latency, error_rate, error_status, variants, width, seed):
+    server = ThreadingHTTPServer(('127.0.0.1', port), ImageRequestHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.variants = image_variants(variants, width)
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'errors': 0, 'images': 0, 'bytes': 0}
+    # The parent process waits for this line before sending requests
+    print(f'PORT {server.server_address[1]}', flush=True)
+    server.serve_forever()
+
+
+class ImageServer:
+    """Runs the image server in a child process for the lifetime of a with-block"""
+
+    def __init__(self, latency=0.05, error_rate=0.0, error_status=503, variants=16, width=1280, seed=1):
+        self.options = [
+            '--latency', str(latency), '--error-rate', str(error_rate),
+            '--error-status', str(error_status), '--variants', str(variants),
+            '--width', str(width), '--seed', str(seed)
+        ]
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--port', '0', *self.options],
+            stdout=subprocess.PIPE, text=True
+        )
+        line = self.process.stdout.readline()
+        if not line.startswith('PORT '):
+            self.process.kill()
+            raise Exception(f"Image server failed to start: {line!r}")
+        self.base_url = f'http://127.0.0.1:{int(line.split()[1])}'
+        return self
+
+    def stats(self):
+        with urllib.request.urlopen(f'{self.base_url}/__stats', timeout=10) as response:
+            return json.loads(response.read())
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local image host for offline benchmarks')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before each image response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of image requests that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--variants', type=int, default=16, help='distinct images served')
+    parser.add_argument('--width', type=int, default=1280, help='image width in pixels')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    serve(args.port, args.latency, args.error_rate, args.error_status, args.variants, args.width, args.seed)
+
+
+if __name__ == '__main__':
+    main()
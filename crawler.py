@@ -0,0 +1,250 @@
+"""
+Background crawler that keeps the hash store current for a set of subreddits.
+
+Polls each subreddit's new (or hot) listing, queues posts it has not indexed
+yet and hashes them on a worker pool, so find_duplicates can answer from the
+store (SCAN_SOURCE=index) without downloading anything during a request.
+After every round the new hashes are sealed into memory-mapped segments for
+time-window searches (see segment_store.py), which are compacted and trimmed
+to the retention window as they go.
+
+    python crawler.py pics memes --listing new --interval 60 --workers 8
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+import logging
+from reddit_client import RedditClient
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class SubredditCrawler:
+    def __init__(self, reddit_client, subreddits, listing='new', limit=100, interval=60,
+                 workers=4, backlog=500, rate_limit_reserve=10, max_pages=10):
+        self.client = reddit_client
+        self.store = reddit_client.hash_store
+        self.segments = reddit_client.segment_store
+        self.subreddits = list(subreddits)
+        self.listing = listing
+        self.limit = limit
+        self.interval = interval
+        self.workers = workers
+        # Listing pages walked back per poll to reach the cursor (Reddit serves ~1000 posts)
+        self.max_pages = max_pages
+        # Minimum API calls to leave in the current rate-limit window
+        self.rate_limit_reserve = rate_limit_reserve
+        # Bounded so a burst of new posts applies backpressure to polling
+        self.backlog = queue.Queue(maxsize=backlog)
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {'polls': 0, 'queued': 0, 'indexed': 0, 'failed': 0, 'deferred': 0, 'gaps': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _wait_for_rate_limit(self):
+        """Sleep until the rate-limit window resets if we are close to exhausting it"""
+        limits = self.client.reddit.auth.limits
+        remaining = limits.get('remaining')
+        reset_timestamp = limits.get('reset_timestamp')
+        if remaining is not None and reset_timestamp and remaining < self.rate_limit_reserve:
+            delay = max(0, reset_timestamp - time.time()) + 1
+            logger.warning(f"Only {remaining:.0f} Reddit API calls left, pausing {delay:.0f}s")
+            self._stop.wait(delay)
+
+    def _listing(self, subreddit_name, after=None):
+        subreddit = self.client.reddit.subreddit(subreddit_name)
+        if self.listing == 'hot':
+            return subreddit.hot(limit=self.limit)
+        if after:
+            return subreddit.new(limit=self.limit, params={'after': after})
+        return subreddit.new(limit=self.limit)
+
+    def poll(self, subreddit_name):
+        """Queue unseen image posts from one subreddit; returns how many were queued"""
+        self._wait_for_rate_limit()
+        cursor = self.store.get_crawl_cursor(subreddit_name)
+        newest = None
+        queued = 0
+        complete = True
+        # Only the new listing can walk back to the cursor; hot is a snapshot
+        reached = not (self.listing == 'new' and cursor and cursor['last_fullname'])
+        after = None
+
+        for page in range(self.max_pages if not reached else 1):
+            listed = 0
+            for submission in self._listing(subreddit_name, after):
+                if self._stop.is_set():
+                    complete = False
+                    break
+                listed += 1
+                after = submission.fullname
+                # The new listing is newest-first, so stop at the last post seen
+                if not reached and (
+                    submission.fullname == cursor['last_fullname']
+                    or submission.created_utc <= (cursor['last_created_utc'] or 0)
+                ):
+                    reached = True
+                    break
+                if newest is None or submission.created_utc > newest.created_utc:
+                    newest = submission
+
+                post = self.client.post_record(submission)
+                # Gallery posts queue one job per image
+                for position, image_url in self.client.post_images(post):
+                    if self.store.get(post['id'], image_url):
+                        continue
+                    key = (post['id'], image_url)
+                    with self._inflight_lock:
+                        if key in self._inflight:
+                            continue
+                        self._inflight.add(key)
+                    try:
+                        self.backlog.put((subreddit_name, post, image_url, position), timeout=self.interval)
+                        queued += 1
+                    except queue.Full:
+                        with self._inflight_lock:
+                            self._inflight.discard(key)
+                        self._count('deferred')
+                        logger.warning(f"Backlog full, deferring the rest of r/{subreddit_name} to the next poll")
+                        complete = False
+                        break
+                if not complete:
+                    break
+            # A short page means the listing has nothing older
+            if reached or not complete or listed < self.limit:
+                break
+            if page + 1 < self.max_pages:
+                self._wait_for_rate_limit()
+
+        if complete and not reached:
+            # More posts arrived since the last poll than the listing could page
+            # through; the ones in between will not be indexed
+            self._count('gaps')
+            logger.warning(f"r/{subreddit_name} listing did not reach the last post seen "
+                           f"({cursor['last_fullname']}) within {self.max_pages} pages of {self.limit}; "
+                           f"older new posts were skipped")
+
+        # Only advance the cursor once everything newer than it has been queued
+        if complete and newest is not None:
+            self.store.set_crawl_cursor(subreddit_name, newest.fullname, newest.created_utc)
+        elif complete and cursor is None:
+            # Nothing to index yet, but mark the subreddit as crawled
+            self.store.set_crawl_cursor(subreddit_name, None, None)
+        self._count('polls')
+        self._count('queued', queued)
+        logger.info(f"Polled r/{subreddit_name}: queued {queued} images, backlog {self.backlog.qsize()}")
+        return queued
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                subreddit_name, post, image_url, position = self.backlog.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.client.index_post_image(post, image_url, subreddit_name, position)
+                self._count('indexed')
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Failed to index {image_url} from submission {post['id']}: {str(e)}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight.discard((post['id'], image_url))
+                self.backlog.task_done()
+
+    def run(self, once=False):
+        """Poll all subreddits every `interval` seconds until stopped (or once, then drain)"""
+        threads = [
+            threading.Thread(target=self._worker, name=f'crawler-worker-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                for subreddit_name in self.subreddits:
+                    try:
+                        self.poll(subreddit_name)
+                    except Exception as e:
+                        logger.error(f"Error polling r/{subreddit_name}: {str(e)}")
+                if once:
+                    self.backlog.join()
+                self.maintain_segments()
+                if once:
+                    break
+                logger.info(f"Crawler stats: {self.stats}")
+                self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join(timeout=5)
+        logger.info(f"Crawler stopped: {self.stats}")
+
+    def maintain_segments(self):
+        """Seal, compact and expire the historical segments of every crawled subreddit"""
+        for subreddit_name in self.subreddits:
+            try:
+                self.segments.maintain(subreddit_name)
+            except Exception as e:
+                logger.error(f"Error maintaining segments for r/{subreddit_name}: {str(e)}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Continuously pre-hash new posts from subreddits')
+    parser.add_argument('subreddits', nargs='*',
+                        default=[name for name in os.getenv('CRAWL_SUBREDDITS', '').split(',') if name],
+                        help='subreddits to crawl (default: CRAWL_SUBREDDITS, comma separated)')
+    parser.add_argument('--listing', choices=('new', 'hot'), default=os.getenv('CRAWL_LISTING', 'new'))
+    parser.add_argument('--limit', type=int, default=int(os.getenv('CRAWL_LIMIT', 100)),
+                        help='posts fetched per listing call')
+    parser.add_argument('--interval', type=float, default=float(os.getenv('CRAWL_INTERVAL', 60)),
+                        help='seconds between polls of the full subreddit set')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CRAWL_WORKERS', 4)),
+                        help='concurrent image downloads')
+    parser.add_argument('--backlog', type=int, default=int(os.getenv('CRAWL_BACKLOG', 500)),
+                        help='maximum queued images awaiting download')
+    parser.add_argument('--rate-limit-reserve', type=int, default=int(os.getenv('CRAWL_RATE_LIMIT_RESERVE', 10)),
+                        help='pause polling when fewer Reddit API calls remain in the window')
+    parser.add_argument('--max-pages', type=int, default=int(os.getenv('CRAWL_MAX_PAGES', 10)),
+                        help='new listing pages walked back per poll to reach the last post seen')
+    parser.add_argument('--once', action='store_true', help='poll every subreddit once, drain the backlog and exit')
+    args = parser.parse_args()
+
+    if not args.subreddits:
+        parser.error('no subreddits given (pass them as arguments or set CRAWL_SUBREDDITS)')
+
+    crawler = SubredditCrawler(
+        RedditClient(),
+        args.subreddits,
+        listing=args.listing,
+        limit=args.limit,
+        interval=args.interval,
+        workers=args.workers,
+        backlog=args.backlog,
+        rate_limit_reserve=args.rate_limit_reserve,
+        max_pages=args.max_pages
+    )
+    try:
+        crawler.run(once=args.once)
+    except KeyboardInterrupt:
+        crawler.stop()
+
+
+if __name__ == '__main__':
+    main()
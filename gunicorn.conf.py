@@ -1,3 +1,48 @@
+import os
+import tempfile
+
 workers = 4
 bind = "0.0.0.0:8000"
 timeout = 120
+# Import the app and its numpy/PIL/scipy stack once in the master; forked
+# workers share those pages and skip the imports. Clients are still built per
+# worker after the fork (see app.start_warmup)
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# Workers publish their metrics here so /metrics can sum all of them. Set
+# before the app is imported (preload happens before on_starting) and
+# inherited by every worker; one directory per master unless overridden
+_default_metrics_dir = os.path.join(tempfile.gettempdir(), f'dedup-metrics-{os.getpid()}')
+_own_metrics_dir = os.environ.setdefault('METRICS_DIR', _default_metrics_dir) == _default_metrics_dir
+
+
+def on_starting(server):
+    # Drop totals a previous run with the same directory left behind
+    import metrics
+    metrics.clear()
+
+
+def when_ready(server):
+    # Runs in the master before the first fork
+    if preload_app:
+        import app
+        app.preload()
+
+
+def post_fork(server, worker):
+    # Authenticate with Reddit and warm the image stack in the background so
+    # the worker accepts requests immediately; /api/ready reports when done
+    import app
+    app.start_warmup()
+
+
+def child_exit(server, worker):
+    # Keep an exited worker's totals in the aggregated /metrics output
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        import shutil
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
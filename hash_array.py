@@ -0,0 +1,93 @@
+import numpy as np
+from hash_index import HASH_TYPES
+
+# Hex digits per packed 64-bit word
+WORD_HEX = 16
+
+
+def pack_hex(hex_hashes, hash_bits=256):
+    """
+    Pack equal-length hex hash strings into an (N, words) contiguous uint64 array.
+    hash_bits only sets the width of an empty result, (0, hash_bits / 64).
+    """
+    hex_hashes = list(hex_hashes)
+    if not hex_hashes:
+        return np.zeros((0, -(-hash_bits // 64)), dtype=np.uint64)
+    width = max(len(h) for h in hex_hashes)
+    words = -(-width // WORD_HEX)
+    # Left-pad so every hash fills whole big-endian words
+    padded = ''.join(h.rjust(words * WORD_HEX, '0') for h in hex_hashes)
+    packed = np.frombuffer(bytes.fromhex(padded), dtype='>u8')
+    return np.ascontiguousarray(packed.reshape(len(hex_hashes), words), dtype=np.uint64)
+
+
+def unpack_hex(words):
+    """Inverse of pack_hex for a single (words,) row"""
+    return ''.join(f'{int(word):016x}' for word in words)
+
+
+class HashArray:
+    """Hashes for many images stored as one (N, words) uint64 matrix per hash type"""
+
+    def __init__(self, words, keys=None):
+        self.words = words
+        lengths = {len(matrix) for matrix in words.values()}
+        if len(lengths) > 1:
+            raise ValueError("All hash types must have the same number of rows")
+        self.size = lengths.pop() if lengths else 0
+        self.keys = list(keys) if keys is not None else list(range(self.size))
+
+    @classmethod
+    def from_hashes(cls, hashes_list, keys=None, hash_types=HASH_TYPES):
+        """Build from a list of {'phash': hex, 'dhash': hex, 'ahash': hex} dicts"""
+        hashes_list = list(hashes_list)
+        words = {
+            hash_type: pack_hex(hashes[hash_type] for hashes in hashes_list)
+            for hash_type in hash_types
+        }
+        return cls(words, keys)
+
+    def __len__(self):
+        return self.size
+
+    def hashes(self, row):
+        """Return the hex hash dict stored at row"""
+        return {hash_type: unpack_hex(matrix[row]) for hash_type, matrix in self.words.items()}
+
+    def distances(self, other, chunk_size=1024):
+        """
+        Return {hash_type: (len(self), len(other)) uint16 Hamming distance matrix}.
+
+        Rows of self are processed in chunks so the intermediate XOR tensor stays
+        bounded at chunk_size * len(other) * words * 8 bytes.
+        """
+        result = {}
+        for hash_type, matrix in self.words.items():
+            candidates = other.words[hash_type]
+            if not len(matrix) or not len(candidates):
+                # Nothing to compare; word counts need not agree
+                result[hash_type] = np.zeros((len(matrix), len(candidates)), dtype=np.uint16)
+                continue
+            out = np.empty((len(matrix), len(candidates)), dtype=np.uint16)
+            for start in range(0, len(matrix), chunk_size):
+                block = matrix[start:start + chunk_size]
+                xor = np.bitwise_xor(block[:, None, :], candidates[None, :, :])
+                out[start:start + chunk_size] = np.bitwise_count(xor).sum(axis=2, dtype=np.uint16)
+            result[hash_type] = out
+        return result
+
+    def min_distances(self, other, chunk_size=1024):
+        """Return the (len(self), len(other)) matrix of best distances across hash types"""
+        matrices = list(self.distances(other, chunk_size).values())
+        return np.minimum.reduce(matrices)
+
+
+def flatten_queries(queries):
+    """
+    Stack queries that are hash dicts or lists of variant hash dicts (robust
+    queries) into one HashArray. Returns (array, owners) where owners[row] is the
+    index of the query that row belongs to.
+    """
+    variants = [query if isinstance(query, list) else [query] for query in queries]
+    owners = np.repeat(np.arange(len(variants)), [len(hashes) for hashes in variants])
+    return HashArray.from_hashes([hashes for group in variants for hashes in group]), owners
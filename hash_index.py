@@ -0,0 +1,125 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_TYPES = ('phash', 'dhash', 'ahash')
+
+
+def _band_layout(hash_bits, bands):
+    """Split hash_bits into `bands` contiguous (shift, mask) ranges of near-equal width"""
+    layout = []
+    start = 0
+    for i in range(bands):
+        width = hash_bits // bands + (1 if i < hash_bits % bands else 0)
+        layout.append((start, (1 << width) - 1))
+        start += width
+    return layout
+
+
+class HashIndex:
+    """
+    In-memory multi-index hash over 256-bit image hashes.
+
+    Each hash is split into threshold + 1 bands. By the pigeonhole principle two
+    hashes within `threshold` bits of each other agree exactly on at least one
+    band, so a lookup only verifies entries that share a band value with the
+    query instead of scanning the whole corpus.
+
+    Only band_types are banded, pHash by default. dHash and aHash of images
+    with flat regions are long runs of 0000/ffff, so their bands collapse into
+    a few buckets holding most of the corpus and a lookup degrades into a scan
+    (see benchmarks/bench_hash_index.py). pHash thresholds DCT coefficients
+    against their median, which keeps its bands spread out. A search therefore
+    returns the entries whose banded hashes are within the threshold, with the
+    distances of every stored type; the dHash/aHash-only matches compare_hashes
+    would also accept need a full batch_matches pass.
+
+    This is for callers holding a long-lived corpus and answering many single
+    lookups against it. The request paths compare each scan's candidates, or a
+    time range of sealed segments, with HashArray in one vectorized pass.
+    """
+
+    def __init__(self, threshold=15, hash_bits=256, hash_types=HASH_TYPES, band_types=('phash',)):
+        self.threshold = threshold
+        self.hash_bits = hash_bits
+        self.hash_types = tuple(hash_types)
+        self.band_types = tuple(band_types)
+        if not set(self.band_types) <= set(self.hash_types):
+            raise ValueError(f"band_types {self.band_types} must be stored hash types {self.hash_types}")
+        self._layout = _band_layout(hash_bits, threshold + 1)
+        self._entries = {}
+        # hash type -> band number -> band value -> keys sharing that value
+        self._buckets = {
+            hash_type: [{} for _ in self._layout] for hash_type in self.band_types
+        }
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _bands(self, value):
+        return [(value >> shift) & mask for shift, mask in self._layout]
+
+    def add(self, key, hashes):
+        """Insert or replace the hashes stored under key"""
+        values = {hash_type: int(hashes[hash_type], 16) for hash_type in self.hash_types}
+        with self._lock:
+            if key in self._entries:
+                self.remove(key)
+            self._entries[key] = values
+            for hash_type in self.band_types:
+                buckets = self._buckets[hash_type]
+                for band, band_value in enumerate(self._bands(values[hash_type])):
+                    buckets[band].setdefault(band_value, []).append(key)
+
+    def remove(self, key):
+        """Delete key from the index; returns False if it was not present"""
+        with self._lock:
+            values = self._entries.pop(key, None)
+            if values is None:
+                return False
+            for hash_type in self.band_types:
+                buckets = self._buckets[hash_type]
+                for band, band_value in enumerate(self._bands(values[hash_type])):
+                    bucket = buckets[band][band_value]
+                    bucket.remove(key)
+                    if not bucket:
+                        del buckets[band][band_value]
+            return True
+
+    def search(self, hashes, threshold=None):
+        """
+        Return (key, distances) for every entry whose closest banded hash type is
+        within threshold, with distances for all stored types.
+
+        Results are sorted by their minimum distance. The threshold may be lowered
+        per query but cannot exceed the one the index was built for.
+        """
+        if threshold is None:
+            threshold = self.threshold
+        if threshold > self.threshold:
+            raise ValueError(f"Index was built for threshold {self.threshold}, got {threshold}")
+
+        query = {hash_type: int(hashes[hash_type], 16) for hash_type in self.hash_types}
+        with self._lock:
+            candidates = set()
+            for hash_type in self.band_types:
+                buckets = self._buckets[hash_type]
+                for band, band_value in enumerate(self._bands(query[hash_type])):
+                    candidates.update(buckets[band].get(band_value, ()))
+
+            results = []
+            for key in candidates:
+                values = self._entries[key]
+                distances = {
+                    hash_type: (query[hash_type] ^ values[hash_type]).bit_count()
+                    for hash_type in self.hash_types
+                }
+                if min(distances[hash_type] for hash_type in self.band_types) <= threshold:
+                    results.append((key, distances))
+        results.sort(key=lambda item: min(item[1][hash_type] for hash_type in self.band_types))
+        return results
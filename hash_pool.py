@@ -0,0 +1,166 @@
+import io
+import os
+import threading
+import multiprocessing
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+_worker_processor = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class _SharedMemoryReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview so PIL decodes without copying the bytes"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self._view) - self._pos)
+        if count <= 0:
+            return 0
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def _init_worker():
+    global _worker_processor
+    from image_processor import ImageProcessor
+    # Workers hash in-process; they must not hand work to a pool of their own
+    _worker_processor = ImageProcessor(hash_pool=False)
+
+
+def _hash_shared(name, size, robust=False):
+    """Worker entry point: hash the image bytes held in the named shared memory block"""
+    from PIL import Image
+    # Workers share the parent's resource tracker, so attaching here does not
+    # create a second registration; the parent unlinks the block when done
+    block = shared_memory.SharedMemory(name=name)
+    view = block.buf[:size]
+    try:
+        with Image.open(_SharedMemoryReader(view)) as image:
+            if robust:
+                return _worker_processor.compute_robust_hashes(image)
+            return _worker_processor.compute_image_hashes(image)
+    finally:
+        view.release()
+        block.close()
+
+
+class ProcessHashPool:
+    """
+    Hashes images in worker processes so large decodes do not hold the GIL of
+    the request thread. Image bytes are handed over through shared memory
+    instead of pickling them (or PIL images) across the process boundary.
+    """
+
+    def __init__(self, workers=None, timeout=None, start_method=None):
+        self.workers = workers or int(os.getenv('HASH_WORKERS', 0)) or os.cpu_count() or 1
+        self.timeout = timeout or float(os.getenv('HASH_TASK_TIMEOUT', 30))
+        # spawn avoids forking a gunicorn worker's threads and open sockets
+        self.start_method = start_method or os.getenv('HASH_POOL_START_METHOD', 'spawn')
+        self._executor = None
+        self._lock = threading.Lock()
+        # One task per worker in flight, so the timeout only runs while a worker
+        # holds the task rather than while it waits in the executor's queue
+        self._slots = threading.BoundedSemaphore(self.workers)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker
+                )
+                logger.info(f"Started hashing process pool with {self.workers} workers")
+            return self._executor
+
+    def _restart(self, executor):
+        """
+        Kill every worker of executor; used when a task overruns so a stuck decode
+        cannot pin a core. A no-op if another thread already replaced it.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        processes = list(getattr(executor, '_processes', {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def hash_bytes(self, data, robust=False):
+        """
+        Hash raw image bytes in a worker process, raising if it exceeds the task
+        timeout. robust=True returns ImageProcessor.compute_robust_hashes' variants.
+        """
+        size = len(data)
+        with self._slots:
+            block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            try:
+                block.buf[:size] = data
+                # A second attempt only when another task's restart killed ours
+                for attempt in range(2):
+                    executor = self._get_executor()
+                    future = executor.submit(_hash_shared, block.name, size, robust)
+                    try:
+                        return future.result(timeout=self.timeout)
+                    except FuturesTimeoutError:
+                        logger.error(f"Hashing task exceeded {self.timeout}s, restarting process pool")
+                        self._restart(executor)
+                        raise Exception(f"Image hashing timed out after {self.timeout}s")
+                    except BrokenProcessPool:
+                        if attempt == 0 and self._executor is not executor:
+                            continue
+                        # A worker died (e.g. OOM on a huge image); start fresh for the next task
+                        logger.error("Hashing worker process died, restarting process pool")
+                        self._restart(executor)
+                        raise Exception("Image hashing worker crashed")
+            finally:
+                block.close()
+                block.unlink()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_hash_pool():
+    """Return the process-wide hashing pool, or None unless HASH_WORKERS is set"""
+    global _pool
+    if int(os.getenv('HASH_WORKERS', 0)) <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessHashPool()
+    return _pool
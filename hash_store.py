@@ -0,0 +1,207 @@
+import sqlite3
+import threading
+import time
+import os
+import html
+import urllib.parse
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def open_database(path):
+    """Open a SQLite connection tuned for sharing between gunicorn workers"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers in other workers proceed while one worker writes
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+
+def normalize_image_url(url):
+    """Normalize an image URL so the same file always maps to the same key"""
+    if not url:
+        return None
+    # PRAW returns preview URLs with HTML-escaped query strings
+    url = html.unescape(url)
+    parsed = urllib.parse.urlparse(url)
+    path = urllib.parse.unquote(parsed.path)
+    # Query strings on Reddit media are signatures/size hints that rotate
+    # over time, so they are dropped from the key
+    return f"https://{parsed.netloc.lower()}{path}"
+
+
+class HashStore:
+    """Persistent on-disk index of image hashes for scanned Reddit submissions"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('HASH_STORE_PATH', 'hashes.db')
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connection(self):
+        # sqlite3 connections are not safe to share across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_database(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS image_hashes (
+                    submission_id TEXT NOT NULL,
+                    image_url TEXT NOT NULL,
+                    subreddit TEXT,
+                    phash TEXT NOT NULL,
+                    dhash TEXT NOT NULL,
+                    ahash TEXT NOT NULL,
+                    created_utc REAL,
+                    permalink TEXT,
+                    hashed_at REAL NOT NULL,
+                    PRIMARY KEY (submission_id, image_url)
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_image_hashes_subreddit_created
+                ON image_hashes (subreddit, created_utc)
+            ''')
+            # Columns added after the first release of the store
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(image_hashes)')}
+            added_columns = {
+                'title': 'TEXT',
+                'author': 'TEXT',
+                # Index of the image within a gallery submission; 0 for single images
+                'position': 'INTEGER NOT NULL DEFAULT 0'
+            }
+            for column, definition in added_columns.items():
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE image_hashes ADD COLUMN {column} {definition}')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_state (
+                    subreddit TEXT PRIMARY KEY,
+                    last_fullname TEXT,
+                    last_created_utc REAL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+
+    def get(self, submission_id, image_url):
+        """Return the stored hashes for a submission image, or None if not indexed yet"""
+        key_url = normalize_image_url(image_url)
+        try:
+            row = self._connection().execute(
+                'SELECT phash, dhash, ahash FROM image_hashes '
+                'WHERE submission_id = ? AND image_url = ?',
+                (submission_id, key_url)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Hash store lookup failed for {submission_id}: {str(e)}")
+            return None
+        if row is None:
+            return None
+        return {
+            'phash': row['phash'],
+            'dhash': row['dhash'],
+            'ahash': row['ahash']
+        }
+
+    def put(self, submission_id, image_url, hashes, subreddit=None,
+            created_utc=None, permalink=None, title=None, author=None, position=0):
+        """Insert or refresh the hashes for a submission image (one row per gallery image)"""
+        key_url = normalize_image_url(image_url)
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO image_hashes '
+                    '(submission_id, image_url, subreddit, phash, dhash, ahash, '
+                    'created_utc, permalink, hashed_at, title, author, position) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        submission_id, key_url, subreddit.lower() if subreddit else None,
+                        hashes['phash'], hashes['dhash'], hashes['ahash'],
+                        created_utc, permalink, time.time(), title, author, position
+                    )
+                )
+        except sqlite3.Error as e:
+            # A failed write only costs a re-download next time
+            logger.error(f"Hash store write failed for {submission_id}: {str(e)}")
+
+    def count(self):
+        """Return the number of indexed submission images"""
+        return self._connection().execute('SELECT COUNT(*) FROM image_hashes').fetchone()[0]
+
+    def entries_for_subreddit(self, subreddit, since=None, until=None, hashed_after=None, hashed_through=None):
+        """
+        Return every stored image for a subreddit, newest first, optionally bounded
+        by created_utc [since, until) and by when it was hashed (hashed_after, hashed_through]
+        """
+        query = 'SELECT * FROM image_hashes WHERE subreddit = ?'
+        params = [subreddit.lower()]
+        if since is not None:
+            query += ' AND created_utc >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND created_utc < ?'
+            params.append(until)
+        if hashed_after is not None:
+            query += ' AND hashed_at > ?'
+            params.append(hashed_after)
+        if hashed_through is not None:
+            query += ' AND hashed_at <= ?'
+            params.append(hashed_through)
+        query += ' ORDER BY created_utc DESC, submission_id, position'
+        rows = self._connection().execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def entries_for_submissions(self, submission_ids):
+        """Return the stored rows (post details included) of the given submissions"""
+        submission_ids = list(submission_ids)
+        rows = []
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(submission_ids), 500):
+            batch = submission_ids[start:start + 500]
+            rows.extend(self._connection().execute(
+                f'SELECT * FROM image_hashes WHERE submission_id IN ({", ".join("?" * len(batch))})',
+                batch
+            ).fetchall())
+        return [dict(row) for row in rows]
+
+    def prune(self, subreddit, before):
+        """Delete a subreddit's images posted before `before`; returns how many were removed"""
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                'DELETE FROM image_hashes WHERE subreddit = ? AND created_utc < ?',
+                (subreddit.lower(), before)
+            ).rowcount
+
+    def get_crawl_cursor(self, subreddit):
+        """Return the crawler's last-seen position for a subreddit, or None if never crawled"""
+        row = self._connection().execute(
+            'SELECT last_fullname, last_created_utc, updated_at FROM crawl_state WHERE subreddit = ?',
+            (subreddit.lower(),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def set_crawl_cursor(self, subreddit, last_fullname, last_created_utc):
+        """Record the newest post the crawler has queued for a subreddit"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO crawl_state '
+                '(subreddit, last_fullname, last_created_utc, updated_at) VALUES (?, ?, ?, ?)',
+                (subreddit.lower(), last_fullname, last_created_utc, time.time())
+            )
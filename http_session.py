@@ -0,0 +1,148 @@
+import os
+import threading
+import logging
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Reddit media hosts get large pools since every scan downloads from them
+MEDIA_HOSTS = ('i.redd.it', 'preview.redd.it', 'external-preview.redd.it')
+
+_session = None
+_session_lock = threading.Lock()
+_host_stats = defaultdict(lambda: {'requests': 0, 'connections': 0, 'retries': 0})
+_stats_lock = threading.Lock()
+
+
+def _record(host, counter):
+    with _stats_lock:
+        _host_stats[host or 'unknown'][counter] += 1
+
+
+class CountingHTTPConnection(HTTPConnection):
+    """Counts new sockets and requests so keep-alive reuse can be reported"""
+
+    def connect(self):
+        _record(self.host, 'connections')
+        return super().connect()
+
+    def request(self, *args, **kwargs):
+        _record(self.host, 'requests')
+        return super().request(*args, **kwargs)
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    """HTTPS variant of CountingHTTPConnection"""
+
+    def connect(self):
+        _record(self.host, 'connections')
+        return super().connect()
+
+    def request(self, *args, **kwargs):
+        _record(self.host, 'requests')
+        return super().request(*args, **kwargs)
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools use the counting connection classes"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+
+class CountingRetry(Retry):
+    """Retry policy that records each retry against the host it happened on"""
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        # Raises MaxRetryError once exhausted, so only real retries are counted
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        host = getattr(_pool, 'host', None)
+        _record(host, 'retries')
+        status = getattr(response, 'status', None)
+        logger.warning(f"Retrying request to {host}{url or ''} (status={status}, error={error})")
+        return retry
+
+
+def _retry_policy():
+    return CountingRetry(
+        total=int(os.getenv('HTTP_RETRIES', 3)),
+        # Only 429/5xx are retried: a host that times out or refuses would
+        # otherwise cost (retries + 1) timeouts on the request path, and
+        # read=False re-raises the timeout so callers still see requests.Timeout
+        connect=0,
+        read=False,
+        other=0,
+        backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        respect_retry_after_header=True,
+        # Hand the final 429/5xx back so raise_for_status reports it as usual
+        raise_on_status=False
+    )
+
+
+def _build_session():
+    session = requests.Session()
+    session.headers['User-Agent'] = 'RedditImageDuplicateChecker/1.0'
+
+    media_pool_size = int(os.getenv('HTTP_MEDIA_POOL_SIZE', 16))
+    # At least as many connections as a scan opens to one host at a time, or
+    # the extras are discarded after a single request
+    default_pool_size = int(os.getenv('HTTP_DEFAULT_POOL_SIZE', 0)) or int(os.getenv('SCAN_PER_HOST_LIMIT', 8))
+
+    default_adapter = CountingHTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=default_pool_size,
+        max_retries=_retry_policy()
+    )
+    session.mount('http://', default_adapter)
+    session.mount('https://', default_adapter)
+    for host in MEDIA_HOSTS:
+        session.mount(f'https://{host}/', CountingHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=media_pool_size,
+            max_retries=_retry_policy()
+        ))
+    return session
+
+
+def get_session():
+    """Return the process-wide keep-alive session shared by every ImageProcessor"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+                logger.info("Created shared HTTP session")
+    return _session
+
+
+def connection_stats():
+    """
+    Return per-host counters for this process: requests sent (including
+    retries), sockets opened, requests served on a reused keep-alive
+    connection, and retries.
+    """
+    with _stats_lock:
+        snapshot = {host: dict(counters) for host, counters in _host_stats.items()}
+    for counters in snapshot.values():
+        counters['reused'] = max(0, counters['requests'] - counters['connections'])
+    return snapshot
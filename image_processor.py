@@ -2,9 +2,18 @@ import requests
 import numpy as np
 from PIL import Image
 import imagehash
+import scipy.fftpack
 from io import BytesIO
 import urllib.parse
+from contextlib import nullcontext
 import logging
+import os
+from hash_index import HashIndex
+from hash_array import HashArray
+from http_session import get_session
+from query_cache import QueryHashCache, digest_key, url_key
+from hash_pool import get_hash_pool
+import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -16,57 +25,247 @@ logger = logging.getLogger(__name__)
 # Increase maximum image size limit to 200MP (adjust as needed)
 Image.MAX_IMAGE_PIXELS = 200000000  # 200 million pixels
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Enough leading bytes to recognise every supported format
+SNIFF_BYTES = 12
+
+# Query-side variants for robust matching: mirrored, flipped, rotated and
+# center-cropped reposts. Only queries get them; stored candidates keep one hash.
+ROBUST_TRANSFORMS = (
+    'mirror', 'flip', 'rotate90', 'rotate180', 'rotate270', 'crop95', 'crop90', 'crop85', 'crop80'
+)
+
+
+def transform_image(image, transform):
+    """Apply one of ROBUST_TRANSFORMS to a PIL image"""
+    if transform == 'mirror':
+        return image.transpose(Image.FLIP_LEFT_RIGHT)
+    if transform == 'flip':
+        return image.transpose(Image.FLIP_TOP_BOTTOM)
+    if transform == 'rotate90':
+        return image.transpose(Image.ROTATE_90)
+    if transform == 'rotate180':
+        return image.transpose(Image.ROTATE_180)
+    if transform == 'rotate270':
+        return image.transpose(Image.ROTATE_270)
+    if transform.startswith('crop'):
+        # Keep the central crop<N>% of each side
+        keep = int(transform[len('crop'):]) / 100
+        width, height = image.size
+        left, top = round(width * (1 - keep) / 2), round(height * (1 - keep) / 2)
+        return image.crop((left, top, width - left, height - top))
+    raise ValueError(f"Unknown transform: {transform}")
+
+
+def sniff_image_format(header):
+    """Identify JPEG/PNG/GIF/WebP from magic bytes, or return None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'GIF'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
 class ImageProcessor:
-    def __init__(self):
+    def __init__(self, session=None, query_cache=None, hash_pool=None):
+        # Keep-alive connection pool shared by every processor in the process
+        self.session = session or get_session()
+        # Hashes of recently checked query images, by content digest and URL
+        self.query_cache = query_cache or QueryHashCache()
+        # Optional process pool (HASH_WORKERS > 0) for images big enough to be worth the hand-off
+        self.hash_pool = hash_pool if hash_pool is not None else get_hash_pool()
+        self.pool_min_bytes = int(os.getenv('HASH_POOL_MIN_BYTES', 256 * 1024))
         # Higher hash size for more detail
         self.hash_size = 16
         # More lenient threshold for hamming distance (0-256, lower means more similar)
         self.threshold = 15
+        # Accepted download size range (1KB - 20MB)
+        self.min_image_bytes = 1024
+        self.max_image_bytes = 20 * 1024 * 1024
+        # HASH_EXACT=1 skips decode-time and intermediate downsampling so hashes are
+        # bit-identical to calling imagehash.phash/dhash/average_hash on the full image
+        self.exact = os.getenv('HASH_EXACT', '0') == '1'
+        # Shortest side kept by the shared downsampled intermediate (>= 4x the pHash input)
+        self.intermediate_size = 4 * (self.hash_size * 4)
+
+    def _grayscale_intermediate(self, image):
+        """Decode the image once and return a small grayscale image shared by all hashes"""
+        if not self.exact and image.format == 'JPEG':
+            # Let libjpeg decode straight to luma at 1/2, 1/4 or 1/8 scale, never
+            # going below intermediate_size on either side
+            image.draft('L', (self.intermediate_size, self.intermediate_size))
+        gray = image if image.mode == 'L' else image.convert('L')
+        if not self.exact:
+            factor = min(gray.size) // self.intermediate_size
+            if factor >= 2:
+                # Box-filter reduce once instead of letting three LANCZOS resizes
+                # each walk the full-resolution image
+                gray = gray.reduce(factor)
+        return gray
 
     def compute_image_hashes(self, image):
-        """Compute multiple types of hashes for better accuracy"""
-        phash = imagehash.phash(image, hash_size=self.hash_size)
-        dhash = imagehash.dhash(image, hash_size=self.hash_size)
-        ahash = imagehash.average_hash(image, hash_size=self.hash_size)
+        """
+        Compute pHash, dHash and aHash from a single decode and grayscale conversion.
+
+        Mirrors imagehash.phash/dhash/average_hash step for step. With HASH_EXACT=1
+        the output is bit-identical to them; the default downsampled path stays
+        within 4 bits per hash type on the fixtures in benchmarks/bench_hashing.py,
+        well inside self.threshold.
+        """
+        with metrics.span('decode'):
+            gray = self._grayscale_intermediate(image)
+            # PIL decodes lazily; load here so decode time is not billed to hashing
+            gray.load()
+        return self._hash_intermediate(gray)
+
+    def compute_robust_hashes(self, image):
+        """
+        Hashes of the image followed by one set per ROBUST_TRANSFORMS entry, in
+        that order. The image is decoded once; transforms are applied to the small
+        grayscale intermediate, so each variant costs only the hashing step.
+        """
+        with metrics.span('decode'):
+            gray = self._grayscale_intermediate(image)
+            gray.load()
+        return [self._hash_intermediate(gray)] + [
+            self._hash_intermediate(transform_image(gray, transform)) for transform in ROBUST_TRANSFORMS
+        ]
+
+    def _hash_intermediate(self, gray):
+        size = self.hash_size
+
+        with metrics.span('hash'):
+            pixels = np.asarray(gray.resize((size * 4, size * 4), imagehash.ANTIALIAS))
+            dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+            dctlowfreq = dct[:size, :size]
+            phash = imagehash.ImageHash(dctlowfreq > np.median(dctlowfreq))
+
+            pixels = np.asarray(gray.resize((size + 1, size), imagehash.ANTIALIAS))
+            dhash = imagehash.ImageHash(pixels[:, 1:] > pixels[:, :-1])
+
+            pixels = np.asarray(gray.resize((size, size), imagehash.ANTIALIAS))
+            ahash = imagehash.ImageHash(pixels > np.mean(pixels))
+
         return {
             'phash': str(phash),
             'dhash': str(dhash),
             'ahash': str(ahash)
         }
 
-    def hash_from_url(self, url):
+    def download_image(self, url):
+        """
+        Stream an image into an in-memory buffer, aborting as soon as it exceeds
+        max_image_bytes. The format is sniffed from the first bytes rather than
+        trusting the Content-Type header. Returns a BytesIO rewound to the start.
+        """
+        with metrics.span('download'), self.session.get(url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+
+            # Reject declared oversize bodies before reading any of them; a missing
+            # header is fine since the streamed byte count is enforced below
+            declared_length = response.headers.get('content-length')
+            if declared_length and int(declared_length) > self.max_image_bytes:
+                raise Exception(f"Image size ({declared_length} bytes) is outside acceptable range")
+
+            buffer = BytesIO()
+            header = b''
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > self.max_image_bytes:
+                    raise Exception(f"Image exceeds {self.max_image_bytes} bytes, download aborted")
+                if len(header) < SNIFF_BYTES:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                    # Bail out on HTML error pages etc. before reading the rest
+                    if len(header) == SNIFF_BYTES and not sniff_image_format(header):
+                        raise Exception("URL does not point to a supported image")
+
+        size = buffer.tell()
+        if size < self.min_image_bytes:
+            raise Exception(f"Image size ({size} bytes) is outside acceptable range")
+        if not sniff_image_format(header):
+            raise Exception("URL does not point to a supported image")
+
+        logger.info(f"Successfully downloaded image ({size} bytes)")
+        buffer.seek(0)
+        return buffer
+
+    def _cached(self, key, robust):
+        """Cached hashes for key (every variant of them if robust), or None"""
+        if not robust:
+            return self.query_cache.get(key)
+        variants = []
+        for variant_key in [key] + [f'{key}#{transform}' for transform in ROBUST_TRANSFORMS]:
+            hashes = self.query_cache.get(variant_key)
+            if not hashes:
+                return None
+            variants.append(hashes)
+        return variants
+
+    def _cache(self, key, hashes, robust):
+        if not robust:
+            self.query_cache.put(key, hashes)
+            return
+        # The untransformed hashes stay under the plain key for non-robust lookups
+        self.query_cache.put_many(zip(
+            [key] + [f'{key}#{transform}' for transform in ROBUST_TRANSFORMS], hashes
+        ))
+
+    def _hash_buffer(self, buffer, use_cache=True, robust=False):
+        """
+        Hash an in-memory image, reusing the cached result for byte-identical
+        content. With robust=True returns compute_robust_hashes' list of variants.
+        """
+        key = digest_key(buffer.getbuffer()) if use_cache else None
+        if key:
+            cached = self._cached(key, robust)
+            if cached:
+                logger.info("Reusing cached hashes for identical image content")
+                return cached
+
+        if self.hash_pool and buffer.getbuffer().nbytes >= self.pool_min_bytes:
+            # Decode and hash both happen in the worker process, so time them as one
+            with metrics.span('hash'):
+                hashes = self.hash_pool.hash_bytes(buffer.getbuffer(), robust=robust)
+        else:
+            # Left undecoded so compute_image_hashes can downsample at decode time
+            image = Image.open(buffer)
+
+            # Log image details
+            logger.info(f"Image size: {image.size}, Mode: {image.mode}")
+
+            hashes = self.compute_robust_hashes(image) if robust else self.compute_image_hashes(image)
+        if key:
+            self._cache(key, hashes, robust)
+        return hashes
+
+    def hash_from_url(self, url, use_cache=True, robust=False, download_slot=None):
+        """
+        Download and hash an image. Query images go through the query cache;
+        pass use_cache=False for subreddit candidates, which the hash store covers.
+        robust=True returns the hashes of every ROBUST_TRANSFORMS variant as well.
+        download_slot is an optional context manager (e.g. a per-host semaphore)
+        held for the download only, not while decoding and hashing.
+        """
         # Decode URL-encoded characters
         decoded_url = urllib.parse.unquote(url)
         
         try:
+            if use_cache:
+                cached = self._cached(url_key(decoded_url), robust)
+                if cached:
+                    logger.info(f"Reusing cached hashes for {decoded_url}")
+                    return cached
+
             logger.info(f"Downloading image from: {decoded_url}")
-            response = requests.get(decoded_url, headers={
-                'User-Agent': 'RedditImageDuplicateChecker/1.0'
-            }, timeout=10)  # Added timeout
-            response.raise_for_status()
-            
-            # Verify content type is an image
-            content_type = response.headers.get('content-type', '')
-            if not content_type.startswith('image/'):
-                raise Exception(f"URL does not point to an image. Content-Type: {content_type}")
-            
-            # Verify content length is reasonable (between 1KB and 20MB)
-            content_length = int(response.headers.get('content-length', 0))
-            if not (1024 <= content_length <= 20 * 1024 * 1024):
-                raise Exception(f"Image size ({content_length} bytes) is outside acceptable range")
-            
-            logger.info(f"Successfully downloaded image ({content_length} bytes)")
-            
-            image = Image.open(BytesIO(response.content))
-            # Convert image to RGB if it's in RGBA mode
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-                logger.debug("Converted RGBA image to RGB")
-            
-            # Log image details
-            logger.info(f"Image size: {image.size}, Mode: {image.mode}")
-            
-            hashes = self.compute_image_hashes(image)
+            with download_slot or nullcontext():
+                buffer = self.download_image(decoded_url)
+            hashes = self._hash_buffer(buffer, use_cache, robust)
+            if use_cache:
+                self._cache(url_key(decoded_url), hashes, robust)
             logger.debug(f"Generated hashes: {hashes}")
             return hashes
         except requests.Timeout:
@@ -79,12 +278,12 @@ class ImageProcessor:
             logger.error(f"Failed to process image from URL {url}: {str(e)}")
             raise Exception(f"Failed to process image: {str(e)}")
 
-    def hash_from_file(self, file):
+    def hash_from_file(self, file, robust=False):
         try:
-            image = Image.open(file)
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-            hashes = self.compute_image_hashes(image)
+            data = file.read(self.max_image_bytes + 1)
+            if len(data) > self.max_image_bytes:
+                raise Exception(f"Image exceeds {self.max_image_bytes} bytes")
+            hashes = self._hash_buffer(BytesIO(data), robust=robust)
             logger.debug(f"Successfully processed uploaded file")
             logger.debug(f"Generated hashes: {hashes}")
             return hashes
@@ -92,12 +291,23 @@ class ImageProcessor:
             logger.error(f"Failed to process uploaded file: {str(e)}")
             raise Exception(f"Failed to process image file: {str(e)}")
 
+    def warm_query_cache(self, urls):
+        """Download and hash query image URLs ahead of time; returns {url: error} for failures"""
+        failures = {}
+        for url in urls:
+            try:
+                self.hash_from_url(url)
+            except Exception as e:
+                failures[url] = str(e)
+        return failures
+
     def compare_hashes(self, hashes1, hashes2):
         try:
             # Compare each type of hash
-            phash_diff = self._hamming_distance(hashes1['phash'], hashes2['phash'])
-            dhash_diff = self._hamming_distance(hashes1['dhash'], hashes2['dhash'])
-            ahash_diff = self._hamming_distance(hashes1['ahash'], hashes2['ahash'])
+            with metrics.span('compare'):
+                phash_diff = self._hamming_distance(hashes1['phash'], hashes2['phash'])
+                dhash_diff = self._hamming_distance(hashes1['dhash'], hashes2['dhash'])
+                ahash_diff = self._hamming_distance(hashes1['ahash'], hashes2['ahash'])
             
             # Get the minimum difference (best match) among all hash types
             min_diff = min(phash_diff, dhash_diff, ahash_diff)
@@ -110,13 +320,44 @@ class ImageProcessor:
             logger.error(f"Error comparing hashes: {str(e)}")
             return False
     
+    def batch_distances(self, queries, candidates):
+        """
+        Compare M query hashes against N candidate hashes in one vectorized pass.
+
+        Both arguments may be HashArray instances or lists of hash dicts. Returns
+        {'phash': (M, N), 'dhash': (M, N), 'ahash': (M, N)} distance matrices.
+        """
+        if not isinstance(queries, HashArray):
+            queries = HashArray.from_hashes(queries)
+        if not isinstance(candidates, HashArray):
+            candidates = HashArray.from_hashes(candidates)
+        return queries.distances(candidates)
+
+    def batch_matches(self, queries, candidates, owners=None):
+        """
+        Return an (M, N) boolean matrix of pairs that compare_hashes would accept.
+        With owners (see hash_array.flatten_queries) rows are variants and are OR-ed together
+        into one row per query.
+        """
+        with metrics.span('compare'):
+            distances = self.batch_distances(queries, candidates)
+            found = np.minimum.reduce(list(distances.values())) <= self.threshold
+            if owners is None:
+                return found
+            merged = np.zeros((int(owners[-1]) + 1 if len(owners) else 0, found.shape[1]), dtype=bool)
+            np.logical_or.at(merged, owners, found)
+            return merged
+
+    def create_index(self):
+        """Create an empty pHash similarity index that matches with this processor's threshold"""
+        return HashIndex(threshold=self.threshold, hash_bits=self.hash_size * self.hash_size)
+
     def _hamming_distance(self, hash1_str, hash2_str):
         """Calculate the Hamming distance between two hash strings"""
         try:
             hash1 = int(hash1_str, 16)
             hash2 = int(hash2_str, 16)
-            xor = bin(hash1 ^ hash2)
-            return xor.count('1')
+            return (hash1 ^ hash2).bit_count()
         except ValueError as e:
             logger.error(f"Error calculating hamming distance: {str(e)}")
             return float('inf')
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+import threading
+import logging
+from collections import Counter
+from hash_store import open_database
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# How long a worker may hold the refresh claim on an entry before another may retry
+REFRESH_CLAIM_SECONDS = 30
+
+
+class ListingCache:
+    """
+    TTL cache for Reddit API results shared by all gunicorn workers through SQLite.
+
+    Entries past their TTL but still inside the stale window are returned
+    immediately while a single background refresh (claimed across workers)
+    fetches a new copy. Entries past the stale window are reloaded inline.
+    """
+
+    def __init__(self, path=None, listing_ttl=None, subreddit_ttl=None,
+                 negative_ttl=None, stale_ttl=None):
+        self.path = path or os.getenv('LISTING_CACHE_PATH', 'listing_cache.db')
+        self.listing_ttl = listing_ttl if listing_ttl is not None else float(os.getenv('LISTING_TTL', 120))
+        self.subreddit_ttl = subreddit_ttl if subreddit_ttl is not None else float(os.getenv('SUBREDDIT_TTL', 86400))
+        # Missing/private subreddits are re-checked sooner than existing ones
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(os.getenv('SUBREDDIT_NEGATIVE_TTL', 600))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(os.getenv('LISTING_STALE_TTL', 600))
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_database(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    refresh_started REAL,
+                    PRIMARY KEY (kind, key)
+                )
+            ''')
+
+    def _count(self, kind, event):
+        with self._stats_lock:
+            self.stats[f'{kind}_{event}'] += 1
+
+    def _store(self, kind, key, value, ttl):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries '
+                '(kind, key, value, fetched_at, expires_at, refresh_started) '
+                'VALUES (?, ?, ?, ?, ?, NULL)',
+                (kind, key, json.dumps(value), now, now + ttl)
+            )
+
+    def _claim_refresh(self, kind, key):
+        """Atomically mark an entry as being refreshed; False if another worker has it"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE cache_entries SET refresh_started = ? WHERE kind = ? AND key = ? '
+                'AND (refresh_started IS NULL OR refresh_started < ?)',
+                (now, kind, key, now - REFRESH_CLAIM_SECONDS)
+            )
+        return cursor.rowcount == 1
+
+    def _refresh(self, kind, key, loader, ttl_for):
+        try:
+            value = loader()
+            self._store(kind, key, value, ttl_for(value))
+            self._count(kind, 'refreshes')
+        except Exception as e:
+            # Keep serving the stale copy; the claim expires so a later request retries
+            self._count(kind, 'refresh_failures')
+            logger.error(f"Background refresh of {kind} {key} failed: {str(e)}")
+
+    def get(self, kind, key, loader, ttl_for):
+        """
+        Return the cached value for (kind, key), calling loader() on a miss.
+
+        ttl_for(value) gives the TTL to store a freshly loaded value with, so
+        callers can cache negative results for a shorter time.
+        """
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache_entries WHERE kind = ? AND key = ?',
+            (kind, key)
+        ).fetchone()
+        now = time.time()
+
+        if row is not None and now < row['expires_at']:
+            self._count(kind, 'hits')
+            return json.loads(row['value'])
+
+        if row is not None and now < row['expires_at'] + self.stale_ttl:
+            self._count(kind, 'stale_hits')
+            if self._claim_refresh(kind, key):
+                threading.Thread(
+                    target=self._refresh, args=(kind, key, loader, ttl_for), daemon=True
+                ).start()
+            return json.loads(row['value'])
+
+        self._count(kind, 'misses')
+        value = loader()
+        self._store(kind, key, value, ttl_for(value))
+        return value
+
+    def subreddit_exists(self, name, loader):
+        """Cached existence check; loader() returns True/False and raises on transient errors"""
+        return self.get(
+            'subreddit', name.lower(), loader,
+            lambda exists: self.subreddit_ttl if exists else self.negative_ttl
+        )
+
+    def hot_listing(self, name, limit, loader):
+        """Cached hot listing; loader() returns a list of JSON-serializable post records"""
+        return self.get('hot', f'{name.lower()}:{limit}', loader, lambda _: self.listing_ttl)
+
+    def get_stats(self):
+        """Hit/miss/refresh counters for this process"""
+        with self._stats_lock:
+            return dict(self.stats)
@@ -0,0 +1,251 @@
+import contextvars
+import glob
+import json
+import math
+import os
+import threading
+import time
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from atomic_file import write_json
+
+logger = logging.getLogger(__name__)
+
+# Stages timed on the scan hot path; 'history' is one subreddit's segment search
+# and 'request' is the whole traced request
+STAGES = ('listing', 'download', 'decode', 'hash', 'compare', 'history', 'request')
+
+# Histogram upper bounds in seconds, up to gunicorn's 120s worker timeout
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+# Shared directory each worker writes its totals to; unset keeps metrics per process
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+# Requests slower than this log their per-stage breakdown (0 disables)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 30))
+
+ARCHIVE_FILE = 'metrics-archive.json'
+
+_histograms = defaultdict(lambda: {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+_counters = defaultdict(int)
+_lock = threading.Lock()
+_last_flush = 0.0
+_current_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+
+class Trace:
+    """Stage timings of one request, summed across the threads that worked on it"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'max': 0.0})
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages[stage]
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+
+    def breakdown(self):
+        with self._lock:
+            return {
+                stage: {name: round(value, 4) for name, value in entry.items()}
+                for stage, entry in self.stages.items()
+            }
+
+
+def observe(stage, seconds):
+    """Record one duration in the stage histogram and the active request trace"""
+    with _lock:
+        histogram = _histograms[stage]
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][index] += 1
+                break
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one observation of `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count(name, amount=1):
+    """Add to a monotonically increasing counter, exported as dedup_<name>_total"""
+    if amount:
+        with _lock:
+            _counters[name] += amount
+
+
+def bind(fn):
+    """
+    Wrap fn to run inside a copy of the caller's context so spans recorded on
+    executor threads are attributed to the request that submitted them
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+@contextmanager
+def request_trace(name):
+    """
+    Trace one request: its duration goes to the 'request' histogram, and if it
+    takes longer than SLOW_REQUEST_SECONDS its per-stage breakdown is logged
+    """
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        elapsed = time.perf_counter() - trace.started
+        observe('request', elapsed)
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            count('slow_requests')
+            # Stage seconds are summed over threads, so they can exceed the wall time
+            logger.warning(f"Slow request {name} took {elapsed:.1f}s: {json.dumps(trace.breakdown())}")
+        flush_if_due()
+
+
+def snapshot():
+    """This process's histograms and counters as plain data"""
+    with _lock:
+        return {
+            'histograms': {
+                stage: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                for stage, h in _histograms.items()
+            },
+            'counters': dict(_counters)
+        }
+
+
+def _worker_path(pid):
+    return os.path.join(METRICS_DIR, f'metrics-{pid}.json')
+
+
+def _read_json(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(total, data):
+    for stage, histogram in data.get('histograms', {}).items():
+        merged = total['histograms'].setdefault(
+            stage, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        )
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+        merged['sum'] += histogram['sum']
+        merged['count'] += histogram['count']
+    for name, value in data.get('counters', {}).items():
+        total['counters'][name] = total['counters'].get(name, 0) + value
+    return total
+
+
+def flush():
+    """Publish this process's totals to METRICS_DIR for the other workers to aggregate"""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_json(_worker_path(os.getpid()), snapshot())
+        _last_flush = time.monotonic()
+    except OSError as e:
+        logger.error(f"Failed to write metrics to {METRICS_DIR}: {str(e)}")
+
+
+def flush_if_due():
+    if METRICS_DIR and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def mark_process_dead(pid):
+    """
+    Fold an exited worker's totals into the archive so counters never go
+    backwards; call from gunicorn's child_exit hook
+    """
+    if not METRICS_DIR:
+        return
+    path = _worker_path(pid)
+    data = _read_json(path)
+    if data is None:
+        return
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    archive = _read_json(archive_path) or {'histograms': {}, 'counters': {}}
+    write_json(archive_path, _merge(archive, data))
+    os.remove(path)
+
+
+def clear():
+    """
+    Remove the totals earlier runs left in METRICS_DIR, so a restarted
+    deployment does not add dead pids to its counters; call from gunicorn's
+    on_starting hook, before any worker starts
+    """
+    if not METRICS_DIR:
+        return
+    paths = glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json'))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Failed to remove stale metrics file {path}: {str(e)}")
+    if paths:
+        logger.info(f"Cleared {len(paths)} metrics files from an earlier run in {METRICS_DIR}")
+
+
+def collect():
+    """Totals across every worker sharing METRICS_DIR, or this process alone"""
+    if not METRICS_DIR:
+        return snapshot()
+    flush()
+    total = {'histograms': {}, 'counters': {}}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        data = _read_json(path)
+        if data is not None:
+            _merge(total, data)
+    return total
+
+
+def render():
+    """Prometheus text exposition (format 0.0.4) of collect()"""
+    data = collect()
+    lines = [
+        '# HELP dedup_stage_seconds Time spent per scan stage',
+        '# TYPE dedup_stage_seconds histogram'
+    ]
+    for stage in sorted(data['histograms']):
+        histogram = data['histograms'][stage]
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, histogram['buckets']):
+            cumulative += bucket
+            le = '+Inf' if math.isinf(bound) else repr(float(bound))
+            lines.append(f'dedup_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'dedup_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'dedup_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    for name in sorted(data['counters']):
+        lines.append(f'# TYPE dedup_{name}_total counter')
+        lines.append(f'dedup_{name}_total {data["counters"][name]}')
+    return '\n'.join(lines) + '\n'
+
+
+# A file left behind by an earlier process with our pid would be overwritten
+# on the first flush; keep its totals instead
+if METRICS_DIR and os.path.exists(_worker_path(os.getpid())):
+    mark_process_dead(os.getpid())
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from hash_store import open_database
+
+logger = logging.getLogger(__name__)
+
+
+def digest_key(data):
+    """Cache key for raw image bytes"""
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def url_key(url):
+    """Cache key for an image URL (already cleaned with RedditClient.clean_reddit_url)"""
+    return 'url:' + url
+
+
+class QueryHashCache:
+    """
+    Bounded LRU of query-image hashes keyed by content digest or URL.
+
+    Digest entries never go stale since the hashes are a pure function of the
+    bytes. URL entries expire after url_ttl because the file behind a URL can
+    change. With a path (QUERY_CACHE_PATH) evicted and cold entries are also
+    kept in a SQLite tier shared by all workers.
+    """
+
+    def __init__(self, max_entries=None, path=None, disk_max_entries=None, url_ttl=None):
+        self.max_entries = max_entries or int(os.getenv('QUERY_CACHE_SIZE', 1024))
+        self.path = path or os.getenv('QUERY_CACHE_PATH') or None
+        self.disk_max_entries = disk_max_entries or int(os.getenv('QUERY_CACHE_DISK_SIZE', 100000))
+        self.url_ttl = url_ttl if url_ttl is not None else float(os.getenv('QUERY_CACHE_URL_TTL', 3600))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        if self.path:
+            self._init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_database(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_hashes (
+                    key TEXT PRIMARY KEY,
+                    phash TEXT NOT NULL,
+                    dhash TEXT NOT NULL,
+                    ahash TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_query_hashes_stored ON query_hashes (stored_at)')
+
+    def _expired(self, key, stored_at):
+        return key.startswith('url:') and time.time() - stored_at > self.url_ttl
+
+    def get(self, key):
+        """Return cached hashes for key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                hashes, stored_at = entry
+                if not self._expired(key, stored_at):
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return dict(hashes)
+                del self._entries[key]
+                self.stats['expired'] += 1
+
+        if self.path:
+            row = self._connection().execute(
+                'SELECT phash, dhash, ahash, stored_at FROM query_hashes WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and not self._expired(key, row['stored_at']):
+                hashes = {'phash': row['phash'], 'dhash': row['dhash'], 'ahash': row['ahash']}
+                self._remember(key, hashes, row['stored_at'])
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                return dict(hashes)
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def _remember(self, key, hashes, stored_at):
+        with self._lock:
+            self._entries[key] = (dict(hashes), stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def put(self, key, hashes):
+        """Store hashes under key in memory and, if enabled, on disk"""
+        self.put_many([(key, hashes)])
+
+    def put_many(self, items):
+        now = time.time()
+        items = list(items)
+        for key, hashes in items:
+            self._remember(key, hashes, now)
+        if self.path and items:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO query_hashes (key, phash, dhash, ahash, stored_at) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [(key, h['phash'], h['dhash'], h['ahash'], now) for key, h in items]
+                    )
+                    conn.execute(
+                        'DELETE FROM query_hashes WHERE key IN ('
+                        'SELECT key FROM query_hashes ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                        (self.disk_max_entries,)
+                    )
+            except Exception as e:
+                logger.error(f"Query cache write failed: {str(e)}")
+
+    def warm(self, entries):
+        """
+        Bulk-load precomputed hashes, e.g. from a previous deployment or the hash store.
+
+        entries is an iterable of dicts with 'hashes' and at least one of 'digest'
+        (hex SHA-256 of the bytes) or 'url'. Returns the number of keys loaded.
+        """
+        items = []
+        for entry in entries:
+            if entry.get('digest'):
+                items.append(('sha256:' + entry['digest'], entry['hashes']))
+            if entry.get('url'):
+                items.append((url_key(entry['url']), entry['hashes']))
+        self.put_many(items)
+        logger.info(f"Warmed query cache with {len(items)} keys")
+        return len(items)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM query_hashes')
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_enabled': bool(self.path),
+                'disk_max_entries': self.disk_max_entries if self.path else 0
+            }
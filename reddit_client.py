@@ -1,10 +1,20 @@
-import praw
-from prawcore.exceptions import ResponseException, OAuthException
+from prawcore.exceptions import ResponseException, OAuthException, NotFound, Redirect, Forbidden
+import html
+import importlib
 import urllib.parse
 from datetime import datetime
 import os
+import time
+import threading
+import math
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from image_processor import ImageProcessor
+from hash_store import HashStore
+from hash_array import flatten_queries
+from listing_cache import ListingCache
+from segment_store import SegmentStore
+import metrics
 import logging
 
 # Configure logging
@@ -16,19 +26,67 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+def load_reddit_provider(spec):
+    """
+    Build a PRAW stand-in from a 'module:factory' spec (REDDIT_PROVIDER), e.g. the
+    offline fake in benchmarks/fake_reddit.py
+    """
+    module_name, _, factory_name = spec.partition(':')
+    if not factory_name:
+        raise Exception(f"REDDIT_PROVIDER must look like 'module:factory', got {spec!r}")
+    factory = getattr(importlib.import_module(module_name), factory_name)
+    logger.info(f"Using Reddit provider {spec}")
+    return factory()
+
+
 class RedditClient:
-    def __init__(self):
+    def __init__(self, hash_store=None, processor=None, listing_cache=None, reddit=None,
+                 segment_store=None):
         try:
-            self.reddit = praw.Reddit(
-                client_id=os.getenv('REDDIT_CLIENT_ID'),
-                client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
-                user_agent=os.getenv('REDDIT_USER_AGENT', 'python:image-deduplication-system:v1.0'),
-                
-            )
+            if reddit is None and os.getenv('REDDIT_PROVIDER'):
+                reddit = load_reddit_provider(os.getenv('REDDIT_PROVIDER'))
+            if reddit is not None:
+                # Injected provider (tests, offline benchmarks)
+                self.reddit = reddit
+            else:
+                # Imported here so importing this module stays cheap
+                import praw
+                self.reddit = praw.Reddit(
+                    client_id=os.getenv('REDDIT_CLIENT_ID'),
+                    client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
+                    user_agent=os.getenv('REDDIT_USER_AGENT', 'python:image-deduplication-system:v1.0'),
+                    
+                )
             # Test authentication
             self.reddit.user.me()
             logger.info("Successfully authenticated with Reddit")
-            self.processor = ImageProcessor()
+            if processor is None:
+                from image_processor import ImageProcessor
+                processor = ImageProcessor()
+            self.processor = processor
+            self.hash_store = hash_store or HashStore()
+            # Shared across workers so listings and existence checks cost fewer API calls
+            self.listing_cache = listing_cache or ListingCache()
+            # Sealed history the crawler keeps, for searches with a time range
+            self.segment_store = segment_store or SegmentStore(self.hash_store)
+            # Concurrency limits for the fetch/hash pipeline in find_duplicates
+            self.scan_workers = int(os.getenv('SCAN_WORKERS', 16))
+            self.per_host_limit = int(os.getenv('SCAN_PER_HOST_LIMIT', 8))
+            # Stay well below gunicorn's 120s worker timeout
+            self.scan_deadline = float(os.getenv('SCAN_DEADLINE', 90))
+            # Per-subreddit time budget; slower subreddits return partial results
+            self.subreddit_budget = float(os.getenv('SCAN_SUBREDDIT_BUDGET', 60))
+            # 'index' answers crawled subreddits from the hash store instead of live listings
+            self.scan_source = os.getenv('SCAN_SOURCE', 'live')
+            self.index_window = float(os.getenv('INDEX_WINDOW_DAYS', 30)) * 86400
+            # Gallery images are hashed from the smallest preview at least this wide (0 = full source)
+            self.gallery_preview_width = int(os.getenv('GALLERY_PREVIEW_WIDTH', 320))
+            # Reduced-bandwidth mode for single-image posts: hash the smallest preview
+            # thumbnail at least this wide (0 = full source). Calibrate with
+            # benchmarks/bench_preview_hashing.py
+            self.preview_width = int(os.getenv('PREVIEW_HASH_WIDTH', 0))
+            self._host_slots = {}
+            self._host_slots_lock = threading.Lock()
         except (ResponseException, OAuthException) as e:
             logger.error(f"Reddit authentication failed: {str(e)}")
             raise Exception("Failed to authenticate with Reddit. Please check your API credentials.")
@@ -147,23 +205,202 @@ class RedditClient:
             return None
         except Exception as e:
             logger.error(f"Error extracting image URL from submission {submission.id}: {str(e)}")
-            return None    
-    def find_duplicates(self, image_hashes, subreddits=None):
+            return None
+
+    @staticmethod
+    def smallest_rendition(renditions, min_width):
+        """
+        Unescaped URL of the smallest (width, url) rendition at least min_width
+        wide, or None if there is none. Reddit HTML-escapes preview URLs, which
+        breaks their signature if they are requested as-is.
+        """
+        wide_enough = [(width, url) for width, url in renditions if width >= min_width and url]
+        if not min_width or not wide_enough:
+            return None
+        return html.unescape(min(wide_enough)[1])
+
+    def gallery_rendition(self, media_item):
+        """
+        URL to hash for one gallery image: the smallest preview rendition ('p')
+        at least gallery_preview_width wide, falling back to the full source ('s').
+        At 320px the hashes stay within 5 bits of the source's, far inside the
+        match threshold, for a fraction of the bytes.
+        """
+        url = self.smallest_rendition(
+            [(rendition.get('x', 0), rendition.get('u')) for rendition in media_item.get('p', [])],
+            self.gallery_preview_width
+        )
+        if url:
+            return url
+        url = media_item['s'].get('u')
+        return html.unescape(url) if url else None
+
+    def preview_thumbnail_url(self, submission):
+        """
+        Smallest preview resolution at least preview_width wide for a post,
+        or None when the mode is off or the post has no usable preview
+        """
+        if not self.preview_width:
+            return None
+        try:
+            resolutions = submission.preview['images'][0]['resolutions']
+        except (AttributeError, KeyError, IndexError, TypeError):
+            return None
+        return self.smallest_rendition(
+            [(resolution.get('width', 0), resolution.get('url')) for resolution in resolutions],
+            self.preview_width
+        )
+
+    def extract_image_urls(self, submission):
+        """Extract every image URL from a submission, in gallery order for gallery posts"""
+        try:
+            if submission.is_video:
+                return []
+            if getattr(submission, 'gallery_data', None):
+                media_metadata = getattr(submission, 'media_metadata', None) or {}
+                urls = []
+                for item in submission.gallery_data['items']:
+                    media_item = media_metadata.get(item['media_id'])
+                    if media_item and media_item.get('e') == 'Image':
+                        url = self.gallery_rendition(media_item)
+                        if url:
+                            urls.append(url)
+                logger.info(f"Found gallery post with {len(urls)} images")
+                return urls
+        except Exception as e:
+            logger.error(f"Error extracting gallery images from submission {submission.id}: {str(e)}")
+            return []
+        image_url = self.extract_image_url(submission)
+        if not image_url:
+            return []
+        # The thumbnail is only used for posts that have an image of their own
+        return [self.preview_thumbnail_url(submission) or image_url]
+
+    def post_record(self, submission):
+        """Plain-dict view of a submission with only the fields a scan needs"""
+        image_urls = self.extract_image_urls(submission)
+        return {
+            'id': submission.id,
+            'title': submission.title,
+            'author': str(submission.author),
+            'created_utc': submission.created_utc,
+            'permalink': submission.permalink,
+            'image_url': image_urls[0] if image_urls else None,
+            'image_urls': image_urls
+        }
+
+    @staticmethod
+    def post_images(post):
+        """(position, url) pairs for a post record, including records cached before galleries"""
+        image_urls = post.get('image_urls')
+        if image_urls is None:
+            image_urls = [post['image_url']] if post.get('image_url') else []
+        return list(enumerate(image_urls))
+
+    def subreddit_exists(self, subreddit_name):
+        """Check that a subreddit exists and is visible, through the listing cache"""
+        def load():
+            try:
+                # Fetch basic info about the subreddit to verify it exists
+                return bool(self.reddit.subreddit(subreddit_name).id)
+            except (NotFound, Redirect, Forbidden):
+                return False
+        return self.listing_cache.subreddit_exists(subreddit_name, load)
+
+    def get_hot_posts(self, subreddit_name, limit=50):
+        """Return post records for a subreddit's hot listing, through the listing cache"""
+        def load():
+            subreddit = self.reddit.subreddit(subreddit_name)
+            return [self.post_record(submission) for submission in subreddit.hot(limit=limit)]
+        return self.listing_cache.hot_listing(subreddit_name, limit, load)
+
+    def indexed_posts(self, subreddit_name):
+        """
+        Return post records with stored hashes for a crawled subreddit, limited to
+        the last INDEX_WINDOW_DAYS, or None if the crawler has never visited it.
+        """
+        if not self.hash_store.get_crawl_cursor(subreddit_name):
+            return None
+        since = time.time() - self.index_window
+        return [
+            {
+                'id': entry['submission_id'],
+                'title': entry['title'] or '',
+                'author': entry['author'] or '',
+                'created_utc': entry['created_utc'],
+                'permalink': entry['permalink'],
+                'image_url': entry['image_url'],
+                'position': entry['position'],
+                'hashes': {
+                    'phash': entry['phash'],
+                    'dhash': entry['dhash'],
+                    'ahash': entry['ahash']
+                }
+            }
+            for entry in self.hash_store.entries_for_subreddit(subreddit_name, since=since)
+        ]
+
+    @staticmethod
+    def match_record(post, image_url, position, subreddit_name):
+        """The match dict returned to API clients for one matching post image"""
+        return {
+            'id': post['id'],
+            'title': post['title'],
+            'author': post['author'],
+            'date': datetime.fromtimestamp(post['created_utc']).isoformat(),
+            'reddit_url': f"https://reddit.com{post['permalink']}",
+            'image_url': image_url,
+            'position': position,
+            'subreddit': subreddit_name
+        }
+
+    def find_duplicates(self, image_hashes, subreddits=None, on_match=None, on_progress=None,
+                        source=None, since=None, until=None):
         """
         Search for duplicate images in specified subreddit(s).
         
         Args:
-            image_hashes: Hash(es) of the image to search for
+            image_hashes: Hashes of the image to search for, or a list of hashes of its
+                transformed variants for robust matching
             subreddits: String, list, or set of subreddit names to search in. If None, defaults to 'Philippines'
+            on_match: Optional callback receiving each match dict as soon as it is found
+            on_progress: Optional callback receiving (subreddit_name, stats) whenever a
+                subreddit's counters change; stats['done'] is set once it is finished and
+                stats['partial'] if it ran past its SCAN_SUBREDDIT_BUDGET and was cut short
+            source: 'live' scans hot listings; 'index' looks up subreddits kept up to date
+                by crawler.py in the hash store (falling back to live for uncrawled ones).
+                Defaults to SCAN_SOURCE.
+            since, until: Optional created_utc range. When either is given the search
+                runs over the stored history of the subreddits instead (see search_history)
             
         Returns:
             List of dictionaries containing information about matching posts
         """
+        return self.find_duplicates_batch(
+            [image_hashes], subreddits,
+            on_match=(lambda _, match: on_match(match)) if on_match else None,
+            on_progress=on_progress, source=source, since=since, until=until
+        )[0]
+
+    def find_duplicates_batch(self, queries, subreddits=None, on_match=None, on_progress=None,
+                              source=None, since=None, until=None, deadline=None):
+        """
+        Search for duplicates of several query images in one pass over the subreddits.
+
+        Every listing is fetched and every candidate image hashed once, however
+        many queries there are; candidates are compared against all queries as
+        one M x N matrix. A query may be a list of variant hashes (robust
+        matching, see ImageProcessor.compute_robust_hashes); it matches when any
+        variant does. on_match receives (query_index, match). deadline is an
+        optional time.monotonic() instant that cuts the scan shorter than
+        SCAN_DEADLINE. Returns one list of matches per query, in query order.
+        See find_duplicates for the other arguments.
+        """
         try:
-            matches = []
             total_processed = 0
             total_images = 0
             failed_downloads = 0
+            store_hits = 0
             
             # Default to Philippines if no subreddit specified
             if subreddits is None:
@@ -172,72 +409,292 @@ class RedditClient:
             if not self.reddit:
                 raise Exception("Reddit client not properly initialized")
             
+            source = source or self.scan_source
+
             # Convert input to list if it's a string or set
             if isinstance(subreddits, (str, set)):
                 subreddits = list(subreddits) if isinstance(subreddits, set) else [subreddits]
+            subreddits = list(dict.fromkeys(subreddits))
+            if not subreddits:
+                return [[] for _ in queries]
+
+            if since is not None or until is not None:
+                return self.search_history(queries, subreddits, since, until, on_match, on_progress)
             
             # Validate all subreddit names before processing
             for subreddit_name in subreddits:
                 try:
-                    # Try to fetch basic info about the subreddit to verify it exists
-                    sub_info = self.reddit.subreddit(subreddit_name).id
-                    if not sub_info:
+                    if not self.subreddit_exists(subreddit_name):
                         raise Exception(f"Subreddit r/{subreddit_name} not found")
                 except Exception as e:
                     logger.error(f"Invalid subreddit: r/{subreddit_name} - {str(e)}")
                     raise Exception(f"Subreddit r/{subreddit_name} not found or is private")
 
-            # Process each subreddit
-            for subreddit_name in subreddits:
-                logger.info(f"Scanning subreddit: r/{subreddit_name}")
-                posts_processed = 0
-                subreddit_failures = 0
-                
-                try:
-                    subreddit = self.reddit.subreddit(subreddit_name)
-                    
+            started = time.monotonic()
+            deadline = min(started + self.scan_deadline, deadline or math.inf)
+            # Each subreddit gets its own cutoff so one slow subreddit cannot starve the rest
+            subreddit_deadlines = {
+                name: min(deadline, started + self.subreddit_budget) for name in subreddits
+            }
+            stats = {
+                name: {'posts': 0, 'images': 0, 'processed': 0, 'failures': 0,
+                       'skipped': 0, 'partial': False, 'done': False}
+                for name in subreddits
+            }
+            positions = {name: index for index, name in enumerate(subreddits)}
+            queues = {name: deque() for name in subreddits}
+            listed = set()
+            listing_jobs = {}
+            in_flight = {}
+            query_array, owners = flatten_queries(queries)
+            ordered_matches = [[] for _ in queries]
+            matched_posts = set()
+            active = 0
+            active_lock = threading.Lock()
+            # Set whenever a listing or download finishes so the dispatcher re-checks state
+            wake = threading.Event()
+            executor = ThreadPoolExecutor(max_workers=self.scan_workers)
+            listing_executor = ThreadPoolExecutor(max_workers=len(subreddits))
+
+            def record_match(query_index, order, subreddit_name, post, image_url, position):
+                # A gallery with several matching images is reported once per query
+                if (query_index, post['id']) not in matched_posts:
+                    matched_posts.add((query_index, post['id']))
+                    logger.info(f"Found potential duplicate in r/{subreddit_name}: {post['title']}")
+                    match = self.match_record(post, image_url, position, subreddit_name)
+                    ordered_matches[query_index].append((order, match))
+                    if on_match:
+                        on_match(query_index, match)
+
+            def check_matches(subreddit_name, items):
+                """Compare (order, post, image_url, position, hashes) items against every query"""
+                found = self.processor.batch_matches(query_array, [item[4] for item in items], owners)
+                for query_index, column in zip(*found.nonzero()):
+                    record_match(int(query_index), items[column][0], subreddit_name, *items[column][1:4])
+
+            def report(subreddit_name):
+                if on_progress:
+                    on_progress(subreddit_name, dict(stats[subreddit_name]))
+
+            def load_candidates(subreddit_name):
+                """
+                Runs on the listing pool: fetch posts and pair each of their images
+                with its stored hashes, if any, as post['images'] = [(position, url, hashes)].
+                Crawled subreddits in index mode are searched here instead, returning
+                {'records': matching _hit_records, 'searched': images compared}.
+                """
+                with metrics.span('listing'):
+                    logger.info(f"Scanning subreddit: r/{subreddit_name}")
+                    if source == 'index' and self.hash_store.get_crawl_cursor(subreddit_name):
+                        # Pure index lookup: no listing call and no downloads
+                        try:
+                            with metrics.span('history'):
+                                hits, searched = self.segment_store.search(
+                                    self.processor, query_array, subreddit_name,
+                                    since=time.time() - self.index_window, owners=owners
+                                )
+                            logger.info(f"Searched {searched} indexed images for r/{subreddit_name}")
+                            return {'records': self._hit_records(hits), 'searched': searched}
+                        except Exception as e:
+                            logger.error(f"Segment search of r/{subreddit_name} failed, "
+                                         f"loading its index instead: {str(e)}")
+                        indexed = self.indexed_posts(subreddit_name)
+                        if indexed is not None:
+                            logger.info(f"Using {len(indexed)} indexed images for r/{subreddit_name}")
+                            posts = {}
+                            for entry in indexed:
+                                post = posts.setdefault(entry['id'], {**entry, 'images': []})
+                                post['images'].append(
+                                    (entry['position'], entry['image_url'], entry['hashes'])
+                                )
+                            return list(posts.values())
                     # Search through more posts to ensure we don't miss anything
-                    for submission in subreddit.hot(limit=50):
-                        total_processed += 1
-                        image_url = self.extract_image_url(submission)
-                        
-                        if image_url:
-                            total_images += 1
-                            logger.info(f"Found image in post '{submission.title}' - URL: {image_url}")
-                            try:
-                                logger.debug(f"Attempting to download and process image from: {image_url}")
-                                submission_hashes = self.processor.hash_from_url(image_url)
-                                posts_processed += 1
-                                
-                                if self.processor.compare_hashes(image_hashes, submission_hashes):
-                                    logger.info(f"Found potential duplicate in r/{subreddit_name}: {submission.title}")
-                                    matches.append({
-                                        'id': submission.id,
-                                        'title': submission.title,
-                                        'author': str(submission.author),
-                                        'date': datetime.fromtimestamp(submission.created_utc).isoformat(),
-                                        'reddit_url': f"https://reddit.com{submission.permalink}",
-                                        'image_url': image_url,
-                                        'subreddit': subreddit_name
-                                    })
-                            except Exception as e:
-                                failed_downloads += 1
-                                subreddit_failures += 1
-                                logger.error(f"Failed to process image from {image_url} in submission {submission.id}: {str(e)}")
+                    posts = []
+                    for post in self.get_hot_posts(subreddit_name, limit=50):
+                        post = dict(post)
+                        # Reuse hashes from earlier scans before downloading anything
+                        post['images'] = [
+                            (position, image_url, self.hash_store.get(post['id'], image_url))
+                            for position, image_url in self.post_images(post)
+                        ]
+                        posts.append(post)
+                    return posts
+
+            def absorb_listing(subreddit_name, posts):
+                nonlocal total_processed, total_images, store_hits
+                if isinstance(posts, dict):
+                    # Index mode already compared every stored image in the window
+                    searched = posts['searched']
+                    total_images += searched
+                    store_hits += searched
+                    stats[subreddit_name]['images'] += searched
+                    stats[subreddit_name]['processed'] += searched
+                    for rank, (query_index, post, image_url, position) in enumerate(posts['records']):
+                        order = (positions[subreddit_name], rank, position)
+                        record_match(query_index, order, subreddit_name, post, image_url, position)
+                    listed.add(subreddit_name)
+                    return
+                known = []
+                for post_index, post in enumerate(posts):
+                    total_processed += 1
+                    stats[subreddit_name]['posts'] += 1
+                    for position, image_url, hashes in post['images']:
+                        total_images += 1
+                        stats[subreddit_name]['images'] += 1
+                        order = (positions[subreddit_name], post_index, position)
+                        if hashes:
+                            known.append((order, post, image_url, position, hashes))
+                        else:
+                            logger.info(f"Found image in post '{post['title']}' - URL: {image_url}")
+                            queues[subreddit_name].append((order, post, image_url, position))
+
+                if known:
+                    # Compare everything already hashed in one vectorized pass
+                    check_matches(subreddit_name, known)
+                    store_hits += len(known)
+                    stats[subreddit_name]['processed'] += len(known)
+                listed.add(subreddit_name)
+
+            def task_done(_):
+                nonlocal active
+                with active_lock:
+                    active -= 1
+                wake.set()
+
+            def finish(future):
+                nonlocal failed_downloads
+                order, subreddit_name, post, image_url, position = in_flight.pop(future)
+                try:
+                    submission_hashes = future.result()
+                    stats[subreddit_name]['processed'] += 1
+                    check_matches(subreddit_name, [(order, post, image_url, position, submission_hashes)])
                 except Exception as e:
-                    logger.error(f"Error processing subreddit r/{subreddit_name}: {str(e)}")
-                    continue
-                
-                logger.info(f"Subreddit r/{subreddit_name} summary:")
-                logger.info(f"- Successfully processed: {posts_processed} images")
-                logger.info(f"- Failed downloads: {subreddit_failures}")
-            
-            logger.info("\nScan Complete - Summary:")
-            logger.info(f"Total posts checked: {total_processed}")
-            logger.info(f"Total images found: {total_images}")
-            logger.info(f"Successfully processed: {total_images - failed_downloads}")
-            logger.info(f"Failed downloads: {failed_downloads}")
-            logger.info(f"Potential matches found: {len(matches)}")
+                    failed_downloads += 1
+                    stats[subreddit_name]['failures'] += 1
+                    logger.error(f"Failed to process image from {image_url} in submission {post['id']}: {str(e)}")
+
+            def cut_off(subreddit_name):
+                """Stop scanning a subreddit that ran out of time, keeping what it found so far"""
+                abandoned = [future for future, job in in_flight.items() if job[1] == subreddit_name]
+                for future in abandoned:
+                    future.cancel()
+                    del in_flight[future]
+                skipped = len(queues[subreddit_name]) + len(abandoned)
+                queues[subreddit_name].clear()
+                stats[subreddit_name]['skipped'] += skipped
+                stats[subreddit_name]['partial'] = True
+                stats[subreddit_name]['done'] = True
+                logger.warning(f"r/{subreddit_name} exceeded its time budget; "
+                               f"returning partial results ({skipped} images skipped)")
+                report(subreddit_name)
+
+            def next_subreddit(rotation):
+                """
+                Round-robin over subreddits that still have images waiting, each
+                limited to an equal share of the workers so a subreddit with slow
+                downloads cannot end up holding every slot
+                """
+                running = Counter(job[1] for job in in_flight.values())
+                contending = [name for name in subreddits if queues[name] or running[name]]
+                share = math.ceil(self.scan_workers / max(len(contending), 1))
+                for _ in range(len(rotation)):
+                    subreddit_name = rotation[0]
+                    rotation.rotate(-1)
+                    if queues[subreddit_name] and running[subreddit_name] < share:
+                        return subreddit_name
+                return None
+
+            try:
+                # Fetch every listing concurrently
+                for subreddit_name in subreddits:
+                    future = listing_executor.submit(metrics.bind(load_candidates), subreddit_name)
+                    future.add_done_callback(lambda _: wake.set())
+                    listing_jobs[future] = subreddit_name
+
+                rotation = deque(subreddits)
+                while True:
+                    wake.clear()
+                    now = time.monotonic()
+
+                    for future in [future for future in listing_jobs if future.done()]:
+                        subreddit_name = listing_jobs.pop(future)
+                        if stats[subreddit_name]['done']:
+                            continue
+                        try:
+                            absorb_listing(subreddit_name, future.result())
+                        except Exception as e:
+                            logger.error(f"Error processing subreddit r/{subreddit_name}: {str(e)}")
+                            listed.add(subreddit_name)
+                        report(subreddit_name)
+
+                    changed = set()
+                    for future in [future for future in in_flight if future.done()]:
+                        changed.add(in_flight[future][1])
+                        finish(future)
+
+                    for subreddit_name in subreddits:
+                        if stats[subreddit_name]['done']:
+                            continue
+                        if now >= subreddit_deadlines[subreddit_name]:
+                            cut_off(subreddit_name)
+                        elif (subreddit_name in listed and not queues[subreddit_name]
+                                and not any(job[1] == subreddit_name for job in in_flight.values())):
+                            stats[subreddit_name]['done'] = True
+                            report(subreddit_name)
+                        elif subreddit_name in changed:
+                            report(subreddit_name)
+
+                    # Keep at most scan_workers downloads running (abandoned ones included),
+                    # handing free slots to subreddits in turn
+                    while active < self.scan_workers:
+                        subreddit_name = next_subreddit(rotation)
+                        if subreddit_name is None:
+                            break
+                        order, post, image_url, position = queues[subreddit_name].popleft()
+                        with active_lock:
+                            active += 1
+                        future = executor.submit(
+                            metrics.bind(self.index_post_image), post, image_url, subreddit_name, position
+                        )
+                        in_flight[future] = (order, subreddit_name, post, image_url, position)
+                        future.add_done_callback(task_done)
+
+                    if all(stats[name]['done'] for name in subreddits):
+                        break
+                    next_cutoff = min(
+                        subreddit_deadlines[name] for name in subreddits if not stats[name]['done']
+                    )
+                    wake.wait(timeout=max(0, next_cutoff - time.monotonic()))
+            finally:
+                # Do not hold the request open for stragglers past the deadline
+                executor.shutdown(wait=False, cancel_futures=True)
+                listing_executor.shutdown(wait=False, cancel_futures=True)
+
+            for subreddit_name in subreddits:
+                logger.debug(f"Subreddit r/{subreddit_name} summary: {stats[subreddit_name]}")
+
+            matches = [
+                [match for _, match in sorted(query_matches, key=lambda item: item[0])]
+                for query_matches in ordered_matches
+            ]
+            match_count = sum(len(query_matches) for query_matches in matches)
+
+            processed = sum(stat['processed'] for stat in stats.values())
+            skipped = sum(stat['skipped'] for stat in stats.values())
+            # Totals are exported on /metrics; one log line per scan is enough
+            metrics.count('scans')
+            metrics.count('posts_checked', total_processed)
+            metrics.count('images_found', total_images)
+            metrics.count('images_processed', processed)
+            metrics.count('download_failures', failed_downloads)
+            metrics.count('images_skipped', skipped)
+            metrics.count('hash_store_hits', store_hits)
+            metrics.count('matches', match_count)
+            logger.info(
+                f"Scan complete: {total_processed} posts, {total_images} images, {processed} processed "
+                f"({store_hits} from hash store), {failed_downloads} failed, {skipped} skipped, "
+                f"{match_count} matches for {len(queries)} queries"
+            )
             
             return matches
             
@@ -247,24 +704,128 @@ class RedditClient:
         except Exception as e:
             logger.error(f"Error searching Reddit: {str(e)}")
             raise Exception(f"Error searching Reddit: {str(e)}")    
+    def search_history(self, queries, subreddits, since=None, until=None, on_match=None, on_progress=None):
+        """
+        Match queries against every stored image of the subreddits posted in
+        [since, until), from the crawler's sealed segments plus hashes not sealed
+        yet. Makes no Reddit calls. Raises if a subreddit was never crawled, since
+        an empty result would read as "no reposts" rather than "no history".
+        Same callbacks and return value as find_duplicates_batch.
+        """
+        uncrawled = [name for name in subreddits if not self.hash_store.get_crawl_cursor(name)]
+        if uncrawled:
+            raise Exception(
+                f"No crawled history for {', '.join(f'r/{name}' for name in uncrawled)}; "
+                f"time-window searches only cover subreddits indexed by crawler.py"
+            )
+        started = time.monotonic()
+        query_array, owners = flatten_queries(queries)
+        matches = [[] for _ in queries]
+        searched_total = 0
+        for subreddit_name in subreddits:
+            with metrics.span('history'):
+                hits, searched = self.segment_store.search(
+                    self.processor, query_array, subreddit_name, since, until, owners
+                )
+            searched_total += searched
+            matched_posts = set()
+            for query_index, post, image_url, position in self._hit_records(hits):
+                # A gallery with several matching images is reported once per query
+                if (query_index, post['id']) in matched_posts:
+                    continue
+                matched_posts.add((query_index, post['id']))
+                match = self.match_record(post, image_url, position, subreddit_name)
+                matches[query_index].append(match)
+                if on_match:
+                    on_match(query_index, match)
+            if on_progress:
+                on_progress(subreddit_name, {
+                    'posts': 0, 'images': searched, 'processed': searched, 'failures': 0,
+                    'skipped': 0, 'partial': False, 'done': True
+                })
+
+        match_count = sum(len(query_matches) for query_matches in matches)
+        metrics.count('history_searches')
+        metrics.count('history_images_searched', searched_total)
+        metrics.count('matches', match_count)
+        logger.info(
+            f"History search complete: {searched_total} stored images in {len(subreddits)} subreddits, "
+            f"{match_count} matches for {len(queries)} queries in {time.monotonic() - started:.2f}s"
+        )
+        return matches
+
+    def _hit_records(self, hits):
+        """(query_index, post, image_url, position) for SegmentStore.search hits, in hit order"""
+        details = {
+            (row['submission_id'], row['position']): row
+            for row in self.hash_store.entries_for_submissions({hit['submission_id'] for _, hit in hits})
+        }
+        records = []
+        for query_index, hit in hits:
+            # Rows pruned from the hash store after sealing keep only what the segment holds
+            row = details.get((hit['submission_id'], hit['position']), {})
+            post = {
+                'id': hit['submission_id'],
+                'title': row.get('title') or '',
+                'author': row.get('author') or '',
+                'created_utc': hit['created_utc'],
+                'permalink': row.get('permalink') or f"/comments/{hit['submission_id']}/"
+            }
+            records.append((query_index, post, row.get('image_url'), hit['position']))
+        return records
+
+    def _host_slot(self, url):
+        """Return the semaphore that limits concurrent downloads from the URL's host"""
+        host = urllib.parse.urlparse(url).netloc.lower()
+        with self._host_slots_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_slots[host] = slot
+            return slot
+
+    def index_post_image(self, post, image_url, subreddit_name, position=0):
+        """Download and hash one submission image, then record it in the hash store"""
+        logger.debug(f"Attempting to download and process image from: {image_url}")
+        # The host slot bounds connections per host, so it covers the download only
+        submission_hashes = self.processor.hash_from_url(
+            image_url, use_cache=False, download_slot=self._host_slot(image_url)
+        )
+        self.hash_store.put(
+            post['id'],
+            image_url,
+            submission_hashes,
+            subreddit=subreddit_name,
+            created_utc=post['created_utc'],
+            permalink=post['permalink'],
+            title=post['title'],
+            author=post['author'],
+            position=position
+        )
+        return submission_hashes
+
+    def hash_from_reddit_url(self, reddit_url, robust=False):
+        """Extract the image from a Reddit post URL and return its hashes (all variants if robust)"""
+        # Extract submission ID from the URL
+        parts = reddit_url.split('comments/')
+        if len(parts) < 2:
+            raise Exception("Invalid Reddit post URL")
+        
+        submission_id = parts[1].split('/')[0]
+        submission = self.reddit.submission(id=submission_id)
+        
+        # Get image URL from the submission
+        image_url = self.extract_image_url(submission)
+        if not image_url:
+            raise Exception("No image found in the Reddit post")
+        
+        return self.processor.hash_from_url(image_url, robust=robust)
+
     def find_duplicates_from_url(self, reddit_url, subreddits=None):
         """Extract image from a Reddit post URL and find duplicates in specified subreddits"""
         try:
-            # Extract submission ID from the URL
-            parts = reddit_url.split('comments/')
-            if len(parts) < 2:
-                raise Exception("Invalid Reddit post URL")
-            
-            submission_id = parts[1].split('/')[0]
-            submission = self.reddit.submission(id=submission_id)
-            
-            # Get image URL from the submission
-            image_url = self.extract_image_url(submission)
-            if not image_url:
-                raise Exception("No image found in the Reddit post")
-            
             # Get image hash and search for duplicates
-            image_hashes = self.processor.hash_from_url(image_url)
+            image_hashes = self.hash_from_reddit_url(reddit_url)
             return self.find_duplicates(image_hashes, subreddits)
             
         except Exception as e:
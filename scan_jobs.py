@@ -0,0 +1,257 @@
+import json
+import os
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from hash_store import open_database
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def scan_key(image_hashes, subreddits, since=None, until=None):
+    """Identity of a scan request; identical in-flight requests share one job"""
+    # Robust queries carry a list of variant hashes; their key covers every variant
+    variants = image_hashes if isinstance(image_hashes, list) else [image_hashes]
+    return json.dumps({
+        'hashes': [[hashes[name] for name in sorted(hashes)] for hashes in variants],
+        'subreddits': sorted({name.lower() for name in subreddits}),
+        'window': [since, until]
+    }, sort_keys=True)
+
+
+class ScanJobManager:
+    """
+    Runs find_duplicates scans in the background and records their progress.
+
+    Job state lives in SQLite so that any gunicorn worker can answer a poll for a
+    job started by another worker, and so identical requests arriving at
+    different workers coalesce onto the same job.
+    """
+
+    def __init__(self, reddit_client, path=None, max_workers=None):
+        self.reddit_client = reddit_client
+        self.path = path or os.getenv('SCAN_JOBS_PATH', 'scan_jobs.db')
+        self.max_workers = max_workers or int(os.getenv('SCAN_JOB_WORKERS', 2))
+        # An active job whose owner has not heartbeated for this long is presumed dead
+        self.stale_after = float(os.getenv('SCAN_JOB_STALE_SECONDS', 300))
+        self.retention = float(os.getenv('SCAN_JOB_RETENTION_SECONDS', 3600))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._local = threading.local()
+        # Jobs queued or running in this process, kept fresh by the heartbeat thread
+        self._owned = set()
+        self._owned_lock = threading.Lock()
+        self._heartbeat = None
+        self._init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_database(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id TEXT PRIMARY KEY,
+                    scan_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    subreddits TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_scan_jobs_key ON scan_jobs (scan_key, status)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS scan_job_matches (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    match TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            ''')
+
+    def _start_heartbeat(self):
+        with self._owned_lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name='scan-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        """
+        Refresh updated_at of every job this process owns, queued ones included,
+        so a job waiting for a free worker slot is never taken for a dead one
+        """
+        interval = self.stale_after / 3
+        while True:
+            time.sleep(interval)
+            with self._owned_lock:
+                job_ids = list(self._owned)
+            if not job_ids:
+                continue
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        f"UPDATE scan_jobs SET updated_at = ? WHERE status IN ('queued', 'running') "
+                        f"AND id IN ({', '.join('?' * len(job_ids))})",
+                        (time.time(), *job_ids)
+                    )
+            except Exception as e:
+                logger.error(f"Failed to heartbeat scan jobs: {str(e)}")
+
+    def submit(self, image_hashes, subreddits, since=None, until=None):
+        """
+        Enqueue a scan, or join an identical one already in flight. since/until
+        make it a historical search (see RedditClient.search_history).
+        Returns (job_id, coalesced)
+        """
+        key = scan_key(image_hashes, subreddits, since, until)
+        now = time.time()
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front so two workers cannot both
+        # miss the existing job and create duplicates
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "UPDATE scan_jobs SET status = 'failed', error = 'Worker stopped responding', updated_at = ? "
+                "WHERE status IN ('queued', 'running') AND updated_at < ?",
+                (now, now - self.stale_after)
+            )
+            row = conn.execute(
+                "SELECT id FROM scan_jobs WHERE scan_key = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                (key,)
+            ).fetchone()
+            if row:
+                conn.execute('COMMIT')
+                logger.info(f"Coalesced scan request onto job {row['id']}")
+                return row['id'], True
+
+            job_id = uuid.uuid4().hex
+            progress = {name: {'posts': 0, 'images': 0, 'processed': 0, 'failures': 0,
+                               'skipped': 0, 'partial': False, 'done': False}
+                        for name in subreddits}
+            conn.execute(
+                'INSERT INTO scan_jobs (id, scan_key, status, subreddits, progress, created_at, updated_at) '
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, key, json.dumps(list(subreddits)), json.dumps(progress), now, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._cleanup()
+        with self._owned_lock:
+            self._owned.add(job_id)
+        self._start_heartbeat()
+        self._executor.submit(self._run, job_id, image_hashes, list(subreddits), since, until)
+        logger.info(f"Queued scan job {job_id} for {', '.join(subreddits)}")
+        return job_id, False
+
+    def _run(self, job_id, image_hashes, subreddits, since=None, until=None):
+        conn = self._connection()
+        lock = threading.Lock()
+        progress = {}
+        seq = 0
+
+        def touch(**fields):
+            fields['updated_at'] = time.time()
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            with conn:
+                conn.execute(f'UPDATE scan_jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+        def on_match(match):
+            nonlocal seq
+            with lock:
+                seq += 1
+                with conn:
+                    conn.execute(
+                        'INSERT INTO scan_job_matches (job_id, seq, match) VALUES (?, ?, ?)',
+                        (job_id, seq, json.dumps(match))
+                    )
+                touch()
+
+        def on_progress(subreddit_name, stats):
+            with lock:
+                progress[subreddit_name] = stats
+                touch(progress=json.dumps(progress))
+
+        try:
+            # Claim the job; it may have been expired while it waited for a slot
+            with conn:
+                claimed = conn.execute(
+                    "UPDATE scan_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), job_id)
+                ).rowcount
+            if not claimed:
+                logger.warning(f"Scan job {job_id} is no longer queued, not running it")
+                return
+            row = conn.execute('SELECT progress FROM scan_jobs WHERE id = ?', (job_id,)).fetchone()
+            progress.update(json.loads(row['progress']))
+            with metrics.request_trace(f'scan job {job_id}'):
+                self.reddit_client.find_duplicates(
+                    image_hashes, subreddits, on_match=on_match, on_progress=on_progress,
+                    since=since, until=until
+                )
+            with lock:
+                touch(status='done', error=None)
+            logger.info(f"Scan job {job_id} finished")
+        except Exception as e:
+            logger.error(f"Scan job {job_id} failed: {str(e)}")
+            with lock:
+                touch(status='failed', error=str(e))
+        finally:
+            with self._owned_lock:
+                self._owned.discard(job_id)
+
+    def get(self, job_id, after=0):
+        """Return job status, per-subreddit progress and the matches after sequence number `after`"""
+        conn = self._connection()
+        row = conn.execute('SELECT * FROM scan_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        matches = conn.execute(
+            'SELECT seq, match FROM scan_job_matches WHERE job_id = ? AND seq > ? ORDER BY seq',
+            (job_id, after)
+        ).fetchall()
+        return {
+            'job_id': job_id,
+            'status': row['status'],
+            'subreddits': json.loads(row['subreddits']),
+            'progress': json.loads(row['progress']),
+            'error': row['error'],
+            'matches': [json.loads(match['match']) for match in matches],
+            'next': matches[-1]['seq'] if matches else after,
+            'finished': row['status'] not in ACTIVE_STATUSES
+        }
+
+    def _cleanup(self):
+        """Drop finished jobs older than the retention window"""
+        cutoff = time.time() - self.retention
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'DELETE FROM scan_job_matches WHERE job_id IN '
+                "(SELECT id FROM scan_jobs WHERE status IN ('done', 'failed') AND updated_at < ?)",
+                (cutoff,)
+            )
+            conn.execute(
+                "DELETE FROM scan_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (cutoff,)
+            )
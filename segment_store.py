@@ -0,0 +1,269 @@
+"""
+Memory-mapped hash segments for historical (time-window) searches.
+
+The hash store stays the write path: the crawler puts hashes into SQLite and
+periodically seals them into immutable .npy segment files, one directory per
+subreddit and one partition per SEGMENT_PARTITION_DAYS of created_utc:
+
+    <SEGMENT_DIR>/<subreddit>/<partition start>-<sequence>.npy
+
+A search opens only the partitions overlapping its time range, with
+numpy's mmap_mode='r', and compares them chunk by chunk, so a year of history
+is scanned without being read into memory. Hashes written since the last seal
+are searched straight from the hash store. Compaction merges the files of a
+partition once it has SEGMENT_COMPACT_FILES of them; retention drops
+partitions (and hash store rows) older than SEGMENT_RETENTION_DAYS.
+"""
+import glob
+import json
+import os
+import re
+import time
+import logging
+import numpy as np
+from atomic_file import atomic_write, write_json
+from hash_array import HashArray, pack_hex
+from hash_index import HASH_TYPES
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+SEGMENT_NAME = re.compile(r'^(\d+)-(\d+)\.npy$')
+
+
+def segment_dtype(id_length, words):
+    """Record layout of one stored image: when it was posted, where, and its packed hashes"""
+    return np.dtype([
+        ('created_utc', '<f8'),
+        ('submission_id', f'S{id_length}'),
+        ('position', '<u2'),
+        *[(hash_type, '<u8', (words,)) for hash_type in HASH_TYPES]
+    ])
+
+
+class SegmentStore:
+    """Sealed, time-partitioned copies of the hash store, searched through memory maps"""
+
+    def __init__(self, hash_store, root=None):
+        self.hash_store = hash_store
+        self.root = root or os.getenv('SEGMENT_DIR', 'segments')
+        self.partition_seconds = float(os.getenv('SEGMENT_PARTITION_DAYS', 7)) * 86400
+        self.retention_seconds = float(os.getenv('SEGMENT_RETENTION_DAYS', 365)) * 86400
+        self.compact_files = int(os.getenv('SEGMENT_COMPACT_FILES', 8))
+        # Rows hashed within this many seconds may still be committing; seal them next time
+        self.seal_lag = float(os.getenv('SEGMENT_SEAL_LAG', 60))
+        # Segment rows compared per batch_matches call
+        self.chunk_rows = int(os.getenv('SEGMENT_CHUNK_ROWS', 65536))
+
+    def _directory(self, subreddit):
+        return os.path.join(self.root, subreddit.lower())
+
+    def _manifest(self, subreddit):
+        try:
+            with open(os.path.join(self._directory(subreddit), MANIFEST_FILE)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {'hashed_through': None}
+
+    def _partition(self, created_utc):
+        return int((created_utc or 0) // self.partition_seconds * self.partition_seconds)
+
+    def segments(self, subreddit, since=None, until=None):
+        """Return {partition start: [segment paths]} for partitions overlapping [since, until)"""
+        partitions = {}
+        for path in glob.glob(os.path.join(self._directory(subreddit), '*.npy')):
+            name = SEGMENT_NAME.match(os.path.basename(path))
+            if not name:
+                continue
+            start = int(name.group(1))
+            if until is not None and start >= until:
+                continue
+            if since is not None and start + self.partition_seconds <= since:
+                continue
+            partitions.setdefault(start, []).append(path)
+        for paths in partitions.values():
+            paths.sort()
+        return partitions
+
+    def _partition_paths(self, subreddit, partition):
+        """Current segment files of one partition, oldest first"""
+        return sorted(glob.glob(os.path.join(self._directory(subreddit), f'{partition}-*.npy')))
+
+    def _write_segment(self, subreddit, partition, records):
+        directory = self._directory(subreddit)
+        os.makedirs(directory, exist_ok=True)
+        existing = [
+            int(SEGMENT_NAME.match(os.path.basename(path)).group(2))
+            for path in self._partition_paths(subreddit, partition)
+        ]
+        path = os.path.join(directory, f'{partition}-{max(existing, default=-1) + 1:06d}.npy')
+        # Newest first, the order matches are reported in
+        records = records[np.argsort(-records['created_utc'], kind='stable')]
+        with atomic_write(path, 'wb') as handle:
+            np.save(handle, records)
+        return path
+
+    def _records(self, rows):
+        """Pack hash store rows into a segment record array"""
+        words = {hash_type: pack_hex(row[hash_type] for row in rows) for hash_type in HASH_TYPES}
+        id_length = max(len(row['submission_id']) for row in rows)
+        records = np.zeros(len(rows), dtype=segment_dtype(id_length, words['phash'].shape[1]))
+        records['created_utc'] = [row['created_utc'] or 0 for row in rows]
+        records['submission_id'] = [row['submission_id'].encode() for row in rows]
+        records['position'] = [row['position'] for row in rows]
+        for hash_type in HASH_TYPES:
+            records[hash_type] = words[hash_type]
+        return records
+
+    def seal(self, subreddit):
+        """Copy hashes written since the last seal into new segments; returns rows sealed"""
+        manifest = self._manifest(subreddit)
+        hashed_through = time.time() - self.seal_lag
+        rows = self.hash_store.entries_for_subreddit(
+            subreddit, hashed_after=manifest['hashed_through'], hashed_through=hashed_through
+        )
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(self._partition(row['created_utc']), []).append(row)
+        for partition, partition_rows in by_partition.items():
+            self._write_segment(subreddit, partition, self._records(partition_rows))
+        os.makedirs(self._directory(subreddit), exist_ok=True)
+        write_json(os.path.join(self._directory(subreddit), MANIFEST_FILE),
+                    {**manifest, 'hashed_through': hashed_through})
+        if rows:
+            logger.info(f"Sealed {len(rows)} hashes of r/{subreddit} into {len(by_partition)} partitions")
+        return len(rows)
+
+    def compact(self, subreddit, force=False):
+        """
+        Merge each partition holding compact_files or more segments (any with
+        more than one if force) into a single file. Rows re-sealed after a
+        refresh are kept once. Returns the number of partitions compacted.
+        """
+        compacted = 0
+        for partition, paths in self.segments(subreddit).items():
+            if len(paths) < (2 if force else self.compact_files):
+                continue
+            parts = [np.load(path) for path in paths]
+            id_length = max(part.dtype['submission_id'].itemsize for part in parts)
+            merged = np.concatenate([
+                part.astype(segment_dtype(id_length, part.dtype['phash'].shape[0])) for part in parts
+            ])
+            # Later segments hold the fresher copy of a row sealed twice
+            keys = np.char.add(np.char.add(merged['submission_id'], b':'),
+                               merged['position'].astype('S5'))
+            _, last = np.unique(keys[::-1], return_index=True)
+            merged = merged[np.sort(len(merged) - 1 - last)]
+            self._write_segment(subreddit, partition, merged)
+            for path in paths:
+                os.remove(path)
+            compacted += 1
+            logger.info(f"Compacted {len(paths)} segments of r/{subreddit} into one ({len(merged)} rows)")
+        return compacted
+
+    def apply_retention(self, subreddit, now=None):
+        """Delete partitions and hash store rows past the retention window; returns files removed"""
+        cutoff = (now or time.time()) - self.retention_seconds
+        removed = 0
+        for partition, paths in self.segments(subreddit, until=cutoff).items():
+            if partition + self.partition_seconds <= cutoff:
+                for path in paths:
+                    os.remove(path)
+                removed += len(paths)
+        pruned = self.hash_store.prune(subreddit, cutoff)
+        if removed or pruned:
+            logger.info(f"Retention removed {removed} segments and {pruned} stored hashes of r/{subreddit}")
+        return removed
+
+    def maintain(self, subreddit):
+        """Seal, compact and apply retention for one subreddit"""
+        self.seal(subreddit)
+        self.compact(subreddit)
+        self.apply_retention(subreddit)
+
+    def disk_usage(self, subreddit):
+        return sum(
+            os.path.getsize(path)
+            for paths in self.segments(subreddit).values() for path in paths
+        )
+
+    def search(self, processor, queries, subreddit, since=None, until=None, owners=None):
+        """
+        Compare a HashArray of queries against every stored image of a subreddit
+        posted in [since, until). Pass owners when rows of queries are variants
+        of fewer queries (see hash_array.flatten_queries). Returns (hits, searched) where hits is a list of
+        (query_index, {'submission_id', 'position', 'created_utc'}) newest first.
+        """
+        hits = []
+        searched = 0
+
+        def compare(found, created_utc, submission_ids, positions, words):
+            """Append matches of these rows to found; returns how many rows were compared"""
+            if not len(created_utc):
+                return 0
+            matched = processor.batch_matches(queries, HashArray(words), owners)
+            for query_index, column in zip(*matched.nonzero()):
+                submission_id = submission_ids[column]
+                found.append((int(query_index), {
+                    'submission_id': submission_id.decode() if isinstance(submission_id, bytes) else submission_id,
+                    'position': int(positions[column]),
+                    'created_utc': float(created_utc[column])
+                }))
+            return len(created_utc)
+
+        def search_segment(found, path):
+            segment = np.load(path, mmap_mode='r')
+            compared = 0
+            for start in range(0, len(segment), self.chunk_rows):
+                chunk = segment[start:start + self.chunk_rows]
+                created_utc = chunk['created_utc']
+                mask = np.ones(len(chunk), dtype=bool)
+                if since is not None:
+                    mask &= created_utc >= since
+                if until is not None:
+                    mask &= created_utc < until
+                rows = np.flatnonzero(mask)
+                compared += compare(
+                    found,
+                    created_utc[rows],
+                    chunk['submission_id'][rows],
+                    chunk['position'][rows],
+                    {hash_type: np.ascontiguousarray(chunk[hash_type][rows], dtype=np.uint64)
+                     for hash_type in HASH_TYPES}
+                )
+            return compared
+
+        manifest = self._manifest(subreddit)
+        if manifest['hashed_through'] is not None:
+            for partition, paths in self.segments(subreddit, since, until).items():
+                for _ in range(3):
+                    found = []
+                    try:
+                        compared = sum(search_segment(found, path) for path in paths)
+                    except (OSError, ValueError) as e:
+                        # Compacted after the listing: the merged file holds these rows and
+                        # those of files already searched, so search the partition again
+                        logger.info(f"Segment of r/{subreddit} changed during search, retrying partition: {str(e)}")
+                        paths = self._partition_paths(subreddit, partition)
+                        continue
+                    hits.extend(found)
+                    searched += compared
+                    break
+                else:
+                    logger.warning(f"Skipping partition {partition} of r/{subreddit}: it kept changing during the search")
+
+        # Hashes not sealed yet (or never, if the crawler runs without segments)
+        tail = self.hash_store.entries_for_subreddit(
+            subreddit, since=since, until=until, hashed_after=manifest['hashed_through']
+        )
+        if tail:
+            searched += compare(
+                hits,
+                np.array([row['created_utc'] or 0 for row in tail], dtype=np.float64),
+                [row['submission_id'] for row in tail],
+                [row['position'] for row in tail],
+                {hash_type: pack_hex(row[hash_type] for row in tail) for hash_type in HASH_TYPES}
+            )
+
+        hits.sort(key=lambda hit: (-hit[1]['created_utc'], hit[1]['submission_id'], hit[1]['position']))
+        return hits, searched
@@ -208,7 +208,7 @@ document.getElementById('imageForm').addEventListener('submit', async (e) => {
     showProgress(isRedditUrl);
 
     try {
-        const response = await fetch('/api/check-duplicates', {
+        const response = await fetch('/api/jobs', {
             method: 'POST',
             body: formData
         });
@@ -218,7 +218,8 @@ document.getElementById('imageForm').addEventListener('submit', async (e) => {
             throw new Error(data.error || 'Failed to check duplicates');
         }
         
-        displayResults(data.results);
+        const results = await pollScanJob(data.status_url);
+        displayResults(results);
     } catch (error) {
         showDetailedError({
             message: error.message || 'An unexpected error occurred',
@@ -230,6 +231,39 @@ document.getElementById('imageForm').addEventListener('submit', async (e) => {
     }
 });
 
+// Poll a background scan job until it finishes, collecting matches as they arrive
+async function pollScanJob(statusUrl) {
+    const progressText = document.querySelector('.progress-text');
+    const matches = [];
+    let after = 0;
+
+    while (true) {
+        const response = await fetch(`${statusUrl}?after=${after}`);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Failed to check duplicates');
+        }
+
+        matches.push(...job.matches);
+        after = job.next;
+
+        const progress = Object.values(job.progress);
+        const done = progress.filter(sub => sub.done).length;
+        const processed = progress.reduce((total, sub) => total + sub.processed + sub.failures, 0);
+        if (progressText && job.status === 'running') {
+            progressText.textContent = `Scanned ${processed} images (${done}/${progress.length} subreddits, ${matches.length} matches)`;
+        }
+
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Scan failed');
+        }
+        if (job.finished) {
+            return matches;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // File input preview
 document.getElementById('imageFile').addEventListener('change', function(e) {
     const file = e.target.files[0];
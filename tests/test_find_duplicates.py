@@ -0,0 +1,113 @@
+"""
+RedditClient.find_duplicates against benchmarks/fake_reddit.FakeReddit.
+
+Images are served from the static/images fixtures by FixtureProcessor
+instead of the image server, so the scan runs offline and in-process.
+Posts whose index is in MATCHING get duplicate1.jpg (the query image);
+every other image post gets duplicate2.jpg, which does not match it.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_reddit import FIXTURES, FakeReddit  # noqa: E402
+from hash_store import HashStore  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from listing_cache import ListingCache  # noqa: E402
+from segment_store import SegmentStore  # noqa: E402
+from reddit_client import RedditClient  # noqa: E402
+
+IMAGE_BASE = 'http://images.invalid'
+SUBREDDIT = 'pics'
+MATCHING = {3, 7, 12, 18}
+
+
+class FixtureProcessor(ImageProcessor):
+    """ImageProcessor whose downloads read the fixtures, after an optional delay"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(hash_pool=False)
+        self.latency = latency
+        with open(FIXTURES[0], 'rb') as handle:
+            self.query = handle.read()
+        with open(FIXTURES[1], 'rb') as handle:
+            self.other = handle.read()
+
+    def download_image(self, url):
+        time.sleep(self.latency)
+        index = int(url.rsplit('/', 1)[-1].split('.')[0])
+        return BytesIO(self.query if index in MATCHING else self.other)
+
+
+def image_indices(reddit, subreddit_name):
+    """Listing indices of the fake posts that carry an image"""
+    return [
+        index for index in range(reddit.posts)
+        if reddit.make_submission(subreddit_name, index).url.startswith(IMAGE_BASE)
+    ]
+
+
+@pytest.fixture
+def make_client(tmp_path):
+    def make(posts=20, latency=0.0, **settings):
+        reddit = FakeReddit(IMAGE_BASE, posts=posts)
+        hash_store = HashStore(str(tmp_path / 'hashes.db'))
+        client = RedditClient(
+            hash_store=hash_store,
+            processor=FixtureProcessor(latency),
+            listing_cache=ListingCache(str(tmp_path / 'listing_cache.db')),
+            reddit=reddit,
+            segment_store=SegmentStore(hash_store, str(tmp_path / 'segments'))
+        )
+        for name, value in settings.items():
+            setattr(client, name, value)
+        return client, reddit
+    return make
+
+
+@pytest.fixture
+def query_hashes():
+    processor = ImageProcessor(hash_pool=False)
+    with open(FIXTURES[0], 'rb') as handle:
+        return processor.hash_from_file(handle)
+
+
+def test_empty_subreddit_list_returns_no_matches(make_client, query_hashes):
+    client, _ = make_client()
+    assert client.find_duplicates(query_hashes, []) == []
+
+
+def test_matches_come_back_in_listing_order(make_client, query_hashes):
+    client, reddit = make_client(scan_workers=4)
+    expected = [f'{SUBREDDIT}_{index}' for index in image_indices(reddit, SUBREDDIT) if index in MATCHING]
+    assert expected
+
+    matches = client.find_duplicates(query_hashes, [SUBREDDIT], source='live')
+
+    assert [match['id'] for match in matches] == expected
+    assert all(match['subreddit'] == SUBREDDIT for match in matches)
+
+
+def test_budget_cut_off_returns_partial_results(make_client, query_hashes):
+    client, reddit = make_client(latency=0.2, scan_workers=2, subreddit_budget=0.5)
+    progress = {}
+
+    matches = client.find_duplicates(
+        query_hashes, [SUBREDDIT], source='live',
+        on_progress=lambda name, stats: progress.update({name: dict(stats)})
+    )
+
+    stats = progress[SUBREDDIT]
+    assert stats['done'] and stats['partial']
+    assert stats['skipped'] > 0
+    assert stats['processed'] < len(image_indices(reddit, SUBREDDIT))
+    # Whatever was found before the cut-off is still returned, in listing order
+    everything = [f'{SUBREDDIT}_{index}' for index in image_indices(reddit, SUBREDDIT) if index in MATCHING]
+    found = [match['id'] for match in matches]
+    assert found == [post_id for post_id in everything if post_id in found]